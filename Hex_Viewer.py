@@ -1,12 +1,25 @@
 import sys
 import os
 import sqlite3
-from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
+import re
+import errno
+import stat
+import json
+import bisect
+import struct
+import zlib
+import lzma
+import zipfile
+import hashlib
+import base64
+import time
+from collections import OrderedDict
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                             QFileDialog, QScrollArea, QLabel, QPushButton, QMessageBox,
                             QSplitter, QTabWidget, QTableWidget, QTableWidgetItem, QHeaderView,
-                            QFrame, QLineEdit)
-from PyQt5.QtCore import Qt, QSettings, QFileInfo, QSize, QPoint
-from PyQt5.QtGui import QColor, QFont, QIcon, QBrush, QColor
+                            QFrame, QInputDialog, QComboBox, QProgressDialog, QAbstractScrollArea)
+from PyQt5.QtCore import Qt, QSettings, QFileInfo, QSize, QPoint, QTimer, QEvent, QMimeData, QByteArray, QRect, QRectF, pyqtSignal
+from PyQt5.QtGui import QColor, QFont, QIcon, QBrush, QColor, QKeySequence, QPainter, QPixmap, QFontMetrics
 
 class ProjectInfo:
     """项目信息元数据（集中管理所有项目相关信息）"""
@@ -64,7 +77,1400 @@ class MacaronColors:
     CARAMEL_CREAM = '#F0E6DD' # 焦糖奶霜
 
 
+class PageCache:
+    """所有数据源共享的LRU页缓存，总内存不超过预算
+
+    编辑过的页、解压器快照和撤销数据不能淘汰，登记为常驻内存并计入预算，
+    缓存页相应减少。
+    """
+    PAGE_SIZE = 64 * 1024
+
+    def __init__(self, budget=256 * 1024 * 1024, readahead_pages=16):
+        self.budget = budget
+        self.readahead_pages = readahead_pages
+        self.used = 0
+        self.pinned = 0  # 缓存之外常驻内存的数据
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()  # (数据源, 页号) -> bytes
+        self._last_access = {}       # 数据源 -> 最近访问的页号，用于识别顺序扫描
+
+    def get(self, source, page_no):
+        key = (source, page_no)
+        sequential = self._last_access.get(source) == page_no - 1
+        self._last_access[source] = page_no
+        data = self._pages.get(key)
+        if data is not None:
+            self.hits += 1
+            self._pages.move_to_end(key)
+            return data
+        
+        self.misses += 1
+        # 顺序扫描时一次读入多页
+        count = self.readahead_pages if sequential else 1
+        start = page_no * self.PAGE_SIZE
+        blob = source._read_range(start, min(count * self.PAGE_SIZE, source.size - start))
+        for i in range(0, len(blob), self.PAGE_SIZE):
+            page_key = (source, page_no + i // self.PAGE_SIZE)
+            if page_key not in self._pages:
+                page = blob[i:i + self.PAGE_SIZE]
+                self._pages[page_key] = page
+                self.used += len(page)
+        self.evict()
+        return blob[:self.PAGE_SIZE]
+
+    def evict(self):
+        while self.used + self.pinned > self.budget and self._pages:
+            _, page = self._pages.popitem(last=False)
+            self.used -= len(page)
+
+    def pin(self, size):
+        """登记常驻内存的数据，相应淘汰缓存页"""
+        self.pinned += size
+        self.evict()
+
+    def unpin(self, size):
+        self.pinned -= size
+
+    def reserve(self, size):
+        """为编辑过的页登记内存，常驻数据超过预算的一半时拒绝"""
+        if self.pinned + size > self.budget // 2:
+            raise MemoryError(
+                f"编辑过的数据超过缓存上限的一半（{self.budget // 2 // 1048576} MB），请在\"缓存设置\"中调大上限"
+            )
+        self.pin(size)
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self.evict()
+
+    def invalidate(self, source):
+        """丢弃某个数据源的全部缓存页"""
+        for key in [key for key in self._pages if key[0] is source]:
+            self.used -= len(self._pages.pop(key))
+        self._last_access.pop(source, None)
+
+    def stats_text(self):
+        total = self.hits + self.misses
+        rate = self.hits * 100.0 / total if total else 0.0
+        return (f"缓存 {(self.used + self.pinned) / 1048576:.1f}/{self.budget / 1048576:.0f} MB "
+                f"(常驻 {self.pinned / 1048576:.1f} MB) | "
+                f"命中 {self.hits} 未命中 {self.misses} ({rate:.1f}%)")
+
+
+page_cache = PageCache()
+
+
+class ByteSource:
+    """按偏移读取的字节数据源基类，支持与bytearray相同的下标访问
+
+    数据通过全局页缓存读取，编辑过的页单独保存，不会被淘汰。
+    """
+    PAGE_SIZE = PageCache.PAGE_SIZE
+    RUN_MIN_LENGTH = 4096  # 单一字节区段的最小长度
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self._dirty_pages = {}  # 编辑过的页: 页号 -> bytearray
+        self._last_page = (-1, b"")
+        self._runs = None
+        self._active_scans = 0
+        self._pending_trims = []  # 扫描进行中的写入范围，扫描结束后从结果中去掉
+
+    def __len__(self):
+        return self.size
+
+    def _read_range(self, offset, size):
+        """从底层读取原始数据（由子类实现）"""
+        raise NotImplementedError
+
+    def _load_page(self, page_no):
+        if page_no in self._dirty_pages:
+            return self._dirty_pages[page_no]
+        # 逐字节访问时避免重复查找缓存
+        if self._last_page[0] == page_no:
+            return self._last_page[1]
+        data = page_cache.get(self, page_no)
+        self._last_page = (page_no, data)
+        return data
+
+    def read(self, offset, size):
+        """读取[offset, offset+size)范围的数据，越界部分被截断"""
+        offset = max(0, offset)
+        end = min(self.size, offset + size)
+        parts = []
+        pos = offset
+        while pos < end:
+            page_no, page_offset = divmod(pos, self.PAGE_SIZE)
+            page = self._load_page(page_no)
+            take = min(end - pos, self.PAGE_SIZE - page_offset)
+            parts.append(bytes(page[page_offset:page_offset + take]))
+            pos += take
+        return b"".join(parts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.size)
+            if step == 1:
+                return self.read(start, stop - start)
+            return bytes(self[i] for i in range(start, stop, step))
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("字节偏移越界")
+        page_no, page_offset = divmod(index, self.PAGE_SIZE)
+        return self._load_page(page_no)[page_offset]
+
+    def __setitem__(self, index, value):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("字节偏移越界")
+        page_no, page_offset = divmod(index, self.PAGE_SIZE)
+        self._edit_page(page_no)[page_offset] = value
+        self._trim_runs(index, index + 1)
+
+    def _edit_page(self, page_no):
+        """返回可修改的页，首次修改时复制一份并计入页缓存的常驻内存"""
+        page = self._dirty_pages.get(page_no)
+        if page is None:
+            page = bytearray(self._load_page(page_no))
+            page_cache.reserve(self.PAGE_SIZE)
+            self._dirty_pages[page_no] = page
+        return page
+
+    def write(self, offset, data):
+        """把data整段写入 [offset, offset+len(data))，按页切片复制"""
+        if offset < 0 or offset + len(data) > self.size:
+            raise IndexError("写入范围越界")
+        pos = 0
+        try:
+            while pos < len(data):
+                page_no, page_offset = divmod(offset + pos, self.PAGE_SIZE)
+                take = min(len(data) - pos, self.PAGE_SIZE - page_offset)
+                # 写入内容与未修改的页相同时不复制该页（撤销时恢复未写入的部分不占内存）
+                if page_no in self._dirty_pages or \
+                        self._load_page(page_no)[page_offset:page_offset + take] != data[pos:pos + take]:
+                    self._edit_page(page_no)[page_offset:page_offset + take] = data[pos:pos + take]
+                pos += take
+        finally:
+            # 中途失败时已写入的页同样不再是单一字节区段
+            self._trim_runs(offset, offset + pos)
+
+    def _trim_runs(self, start, end):
+        """写入后去掉单一字节区段中与 [start, end) 重叠的部分，不必重新扫描"""
+        if self._runs is None:
+            if self._active_scans:
+                self._pending_trims.append((start, end))
+            return
+        runs = []
+        for run_start, run_end, value in self._runs:
+            if run_end <= start or run_start >= end:
+                runs.append((run_start, run_end, value))
+                continue
+            for piece_start, piece_end in ((run_start, start), (end, run_end)):
+                if piece_end - piece_start >= self.RUN_MIN_LENGTH:
+                    runs.append((piece_start, piece_end, value))
+        self._runs = runs
+
+    def _extents(self):
+        """返回覆盖整个数据的区段 [(起始, 结束, 是否为空洞)]"""
+        return [(0, self.size, False)]
+
+    def runs(self):
+        """返回单一字节的连续区段 [(起始, 结束, 字节值)]，结果会被缓存"""
+        if self._runs is None:
+            for _ in self.scan_runs():
+                pass
+        return self._runs
+
+    def runs_ready(self):
+        return self._runs is not None
+
+    def scan_runs(self):
+        """逐页扫描单一字节区段的生成器，每扫描一页产出已扫描到的偏移
+
+        可以在界面空闲时分多次推进；扫描期间的写入会被记录，结束时从结果中去掉。
+        结果缓存后由runs()返回。
+        """
+        self._active_scans += 1
+        try:
+            runs = [run for run in (yield from self._scan_runs()) if run[1] - run[0] >= self.RUN_MIN_LENGTH]
+            if self._runs is None:
+                self._runs = runs
+                for start, end in self._pending_trims:
+                    self._trim_runs(start, end)
+        finally:
+            self._active_scans -= 1
+            if not self._active_scans:
+                self._pending_trims = []
+
+    def _scan_runs(self):
+        runs = []
+
+        def append(start, end, value):
+            if runs and runs[-1][1] == start and runs[-1][2] == value:
+                runs[-1] = (runs[-1][0], end, value)
+            elif end > start:
+                runs.append((start, end, value))
+
+        tail = None  # 上一块末尾的单一字节段 (起始, 字节值)
+        for start, end, is_hole in self._extents():
+            if is_hole:
+                append(tail[0] if tail and tail[1] == 0 else start, end, 0)
+                tail = None
+                yield end
+                continue
+            for page_pos in range(start, end, self.PAGE_SIZE):
+                page = self.read(page_pos, min(self.PAGE_SIZE, end - page_pos))
+                # 整页相同时一次处理，否则按最小区段长度细分
+                if page.count(page[0]) == len(page):
+                    blocks = [(page_pos, page)]
+                else:
+                    step = self.RUN_MIN_LENGTH
+                    blocks = [(page_pos + i, page[i:i + step]) for i in range(0, len(page), step)]
+                for pos, chunk in blocks:
+                    value = chunk[0]
+                    if chunk.count(value) == len(chunk):
+                        # 整块为同一字节，与上一块末尾的同值字节合并
+                        append(tail[0] if tail and tail[1] == value else pos, pos + len(chunk), value)
+                        tail = None
+                    else:
+                        # 块开头的同值字节接到上一块的区段或末尾同值字节之后，跨块边界的区段不会漏掉
+                        head_end = pos + len(chunk) - len(chunk.lstrip(bytes([value])))
+                        if runs and runs[-1][1] == pos and runs[-1][2] == value:
+                            append(pos, head_end, value)
+                        elif tail and tail[1] == value:
+                            append(tail[0], head_end, value)
+                        last = chunk[-1]
+                        tail = (pos + len(chunk.rstrip(bytes([last]))), last)
+                yield page_pos + len(page)
+        return runs
+
+    def close(self):
+        page_cache.invalidate(self)
+        page_cache.unpin(len(self._dirty_pages) * self.PAGE_SIZE)
+        self._dirty_pages = {}
+        self._last_page = (-1, b"")
+
+
+class FileSource(ByteSource):
+    """普通文件，按需读取而不是整个读入内存"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._fh = open(path, 'rb')
+        self.size = os.fstat(self._fh.fileno()).st_size
+
+    def _read_range(self, offset, size):
+        self._fh.seek(offset)
+        return self._fh.read(size)
+
+    def _extents(self):
+        # 稀疏文件：用SEEK_DATA/SEEK_HOLE直接跳过空洞，编辑过后空洞可能已被写入数据
+        if not hasattr(os, "SEEK_HOLE") or self._dirty_pages:
+            return super()._extents()
+        fd = self._fh.fileno()
+        extents = []
+        pos = 0
+        try:
+            while pos < self.size:
+                data = os.lseek(fd, pos, os.SEEK_DATA)
+                if data > pos:
+                    extents.append((pos, data, True))
+                hole = min(os.lseek(fd, data, os.SEEK_HOLE), self.size)
+                extents.append((data, hole, False))
+                pos = hole
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                return super()._extents()
+            # 文件末尾是空洞
+            extents.append((pos, self.size, True))
+        return extents
+
+    def close(self):
+        super().close()
+        self._fh.close()
+
+
+class BlockDeviceSource(FileSource):
+    """原始块设备或大型磁盘镜像，按扇区对齐读取
+
+    块设备的stat大小为0，长度通过seek到末尾或BLKGETSIZE64获得。
+    顺序预读时提示内核提前读入下一段，使大范围比对接近磁盘带宽。
+    """
+    BLKGETSIZE64 = 0x80081272
+    BLKSSZGET = 0x1268
+    DEFAULT_SECTOR_SIZE = 512
+
+    def __init__(self, path):
+        super().__init__(path)
+        fd = self._fh.fileno()
+        self.sector_size = self._ioctl_int(fd, self.BLKSSZGET, "i") or self.DEFAULT_SECTOR_SIZE
+        try:
+            self.size = os.lseek(fd, 0, os.SEEK_END)
+        except OSError:
+            self.size = 0
+        self.size = self.size or self._ioctl_int(fd, self.BLKGETSIZE64, "Q")
+        if not self.size:
+            self._fh.close()
+            raise OSError(f"无法获取设备大小: {path}")
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    @staticmethod
+    def _ioctl_int(fd, request, fmt):
+        try:
+            import fcntl
+            buf = fcntl.ioctl(fd, request, bytes(struct.calcsize(fmt)))
+            return struct.unpack(fmt, buf)[0]
+        except (ImportError, OSError):
+            return 0
+
+    @staticmethod
+    def is_device(path):
+        try:
+            return stat.S_ISBLK(os.stat(path).st_mode)
+        except OSError:
+            return False
+
+    def _read_range(self, offset, size):
+        start = offset - offset % self.sector_size
+        end = -(-(offset + size) // self.sector_size) * self.sector_size
+        if hasattr(os, "pread"):
+            data = os.pread(self._fh.fileno(), end - start, start)
+            if size > self.PAGE_SIZE and hasattr(os, "posix_fadvise"):
+                # 预读时让内核并行读入下一段
+                os.posix_fadvise(self._fh.fileno(), end, end - start, os.POSIX_FADV_WILLNEED)
+        else:
+            self._fh.seek(start)
+            data = self._fh.read(end - start)
+        return data[offset - start:offset - start + size]
+
+
+class _StreamCursor:
+    """压缩流中向前解压的游标"""
+    __slots__ = ("uoff", "coff", "decomp", "pending", "tail")
+
+    def __init__(self, uoff, coff, decomp=None):
+        self.uoff = uoff        # 已输出的解压数据偏移
+        self.coff = coff        # 下一个待读取的压缩数据偏移
+        self.decomp = decomp
+        self.pending = b""      # 已读取但解压器尚未消费的压缩数据
+        self.tail = b""         # 最近一次输出的数据块，便于顺序读取时续接
+
+
+class CompressedSource(ByteSource):
+    """压缩文件的可寻址只读视图
+
+    一次流式解压建立检查点索引（zran方式），之后任意偏移的读取只需
+    从最近的检查点开始解压。检查点为 (解压偏移, 压缩偏移, 解压器状态)，
+    状态为None表示可以从该压缩偏移直接重新开始（gzip成员/xz块边界），
+    这类检查点会保存到数据库中；解压器快照只在本次会话中有效。
+    """
+    CHECKPOINT_SPAN = 4 * 1024 * 1024
+    STATE_SIZE = 48 * 1024  # 一个解压器快照的估计内存（32KB窗口加内部状态）
+    READ_SIZE = 64 * 1024
+    OUT_SIZE = 256 * 1024
+
+    def __init__(self, path, container_path):
+        super().__init__(path)
+        self.container_path = container_path
+        self._fh = open(container_path, 'rb')
+        self._data_end = os.path.getsize(container_path)
+        self.points = []
+        self._point_offsets = []
+        self._cursor = None
+        self._checkpoint_span = self.CHECKPOINT_SPAN
+        self._states = 0  # 保存的解压器快照数量，计入页缓存的常驻内存
+
+    def close(self):
+        super().close()
+        page_cache.unpin(self._states * self.STATE_SIZE)
+        self._states = 0
+        self._fh.close()
+
+    def _read_raw(self, offset, size):
+        if size <= 0:
+            return b""
+        self._fh.seek(offset)
+        return self._fh.read(size)
+
+    def _add_point(self, uoff, coff, state=None):
+        i = bisect.bisect_right(self._point_offsets, uoff)
+        if i > 0 and self._point_offsets[i - 1] == uoff:
+            return
+        self._point_offsets.insert(i, uoff)
+        self.points.insert(i, (uoff, coff, state))
+
+    def _restore(self, point):
+        """从检查点创建游标（由子类实现）"""
+        raise NotImplementedError
+
+    def _advance(self, cursor):
+        """向前解压一段数据，流结束时返回空字节串（由子类实现）"""
+        raise NotImplementedError
+
+    def _snapshot(self, cursor):
+        """返回游标当前位置的检查点，不支持快照时返回None"""
+        return None
+
+    def _maybe_checkpoint(self, cursor):
+        i = bisect.bisect_right(self._point_offsets, cursor.uoff) - 1
+        if cursor.uoff - self._point_offsets[i] >= self._checkpoint_span:
+            point = self._snapshot(cursor)
+            if point is not None:
+                self._add_point(*point)
+                self._states += 1
+                page_cache.pin(self.STATE_SIZE)
+                if self._states * self.STATE_SIZE > page_cache.budget // 4:
+                    self._thin_states()
+
+    def _thin_states(self):
+        """解压器快照超过缓存预算的四分之一时隔一个丢弃一个，检查点间隔加倍"""
+        points = []
+        keep = False
+        for point in self.points:
+            if point[2] is not None:
+                keep = not keep
+                if not keep:
+                    continue
+            points.append(point)
+        dropped = len(self.points) - len(points)
+        self.points = points
+        self._point_offsets = [point[0] for point in points]
+        self._states -= dropped
+        page_cache.unpin(dropped * self.STATE_SIZE)
+        self._checkpoint_span *= 2
+
+    def build_index(self, progress=None):
+        """流式解压整个文件，确定数据长度并建立检查点
+
+        progress(已处理压缩字节, 压缩数据总长) 每解压一个检查点间隔调用一次，
+        返回False时中止并抛出InterruptedError。
+        """
+        cursor = self._restore(self.points[0])
+        start = reported = cursor.coff
+        while True:
+            self._maybe_checkpoint(cursor)
+            chunk = self._advance(cursor)
+            if not chunk:
+                break
+            cursor.uoff += len(chunk)
+            if progress and cursor.uoff - reported >= self.CHECKPOINT_SPAN:
+                reported = cursor.uoff
+                if not progress(cursor.coff - start, self._data_end - start):
+                    raise InterruptedError("已取消建立检查点索引")
+        self.size = cursor.uoff
+
+    def export_index(self):
+        """导出可持久化的检查点（不含解压器快照）"""
+        return [[uoff, coff] for uoff, coff, state in self.points if state is None]
+
+    def load_index(self, size, points):
+        self.size = size
+        for uoff, coff in points:
+            self._add_point(uoff, coff)
+
+    def _read_range(self, offset, size):
+        end = offset + size
+        cursor = self._cursor
+        if cursor is not None and offset < cursor.uoff - len(cursor.tail):
+            cursor = None
+        best = self.points[bisect.bisect_right(self._point_offsets, offset) - 1]
+        if cursor is None or best[0] > cursor.uoff:
+            cursor = self._restore(best)
+        out = bytearray()
+        chunk = cursor.tail
+        chunk_start = cursor.uoff - len(chunk)
+        while True:
+            if chunk_start + len(chunk) > offset:
+                out += chunk[max(0, offset - chunk_start):end - chunk_start]
+            if cursor.uoff >= end:
+                break
+            self._maybe_checkpoint(cursor)
+            chunk = self._advance(cursor)
+            if not chunk:
+                break
+            chunk_start = cursor.uoff
+            cursor.uoff += len(chunk)
+            cursor.tail = chunk
+        self._cursor = cursor
+        return bytes(out)
+
+
+class DeflateSource(CompressedSource):
+    """原始deflate流（ZIP成员）"""
+
+    def __init__(self, path, container_path, data_start, data_end):
+        super().__init__(path, container_path)
+        self._data_end = data_end
+        self._add_point(0, data_start)
+
+    def _new_member(self, cursor):
+        cursor.decomp = zlib.decompressobj(-zlib.MAX_WBITS)
+        cursor.pending = b""
+        return True
+
+    def _end_member(self, cursor):
+        cursor.decomp = None
+        cursor.pending = b""
+        cursor.coff = self._data_end
+
+    def _restore(self, point):
+        uoff, coff, state = point
+        cursor = _StreamCursor(uoff, coff)
+        if state is not None:
+            # 复制一份，保证检查点本身可以重复使用
+            cursor.decomp = state.copy()
+        return cursor
+
+    def _snapshot(self, cursor):
+        if cursor.decomp is None or cursor.decomp.eof:
+            return None
+        return (cursor.uoff, cursor.coff - len(cursor.pending), cursor.decomp.copy())
+
+    def _advance(self, cursor):
+        while True:
+            if cursor.decomp is None:
+                if cursor.coff >= self._data_end or not self._new_member(cursor):
+                    return b""
+            data = cursor.pending
+            if not data:
+                data = self._read_raw(cursor.coff, min(self.READ_SIZE, self._data_end - cursor.coff))
+                cursor.coff += len(data)
+            out = cursor.decomp.decompress(data, self.OUT_SIZE)
+            cursor.pending = cursor.decomp.unconsumed_tail
+            if cursor.decomp.eof:
+                cursor.coff -= len(cursor.decomp.unused_data)
+                self._end_member(cursor)
+                if cursor.decomp is None and cursor.coff < self._data_end:
+                    self._add_point(cursor.uoff + len(out), cursor.coff)
+            if out:
+                return out
+            if not data:
+                return b""
+
+
+class GzipSource(DeflateSource):
+    """gzip文件，支持多个成员首尾相接"""
+
+    def __init__(self, path):
+        super().__init__(path, path, 0, os.path.getsize(path))
+
+    def _new_member(self, cursor):
+        header_len = self._member_header(cursor.coff)
+        if header_len is None:
+            return False
+        cursor.coff += header_len
+        return super()._new_member(cursor)
+
+    def _end_member(self, cursor):
+        # 跳过CRC32和ISIZE，下一个成员可以直接作为检查点
+        cursor.decomp = None
+        cursor.pending = b""
+        cursor.coff += 8
+
+    def _member_header(self, offset):
+        head = self._read_raw(offset, 10)
+        if len(head) < 10 or head[:3] != b"\x1f\x8b\x08":
+            return None
+        flags = head[3]
+        pos = offset + 10
+        if flags & 0x04:  # FEXTRA
+            pos += 2 + struct.unpack("<H", self._read_raw(pos, 2))[0]
+        for flag in (0x08, 0x10):  # FNAME, FCOMMENT
+            if flags & flag:
+                while True:
+                    block = self._read_raw(pos, 256)
+                    if not block:
+                        return None
+                    end = block.find(b"\0")
+                    if end >= 0:
+                        pos += end + 1
+                        break
+                    pos += len(block)
+        if flags & 0x02:  # FHCRC
+            pos += 2
+        return pos - offset
+
+
+class XzSource(CompressedSource):
+    """xz文件，以流索引中的块边界作为检查点"""
+    MAGIC = b"\xfd7zXZ\x00"
+
+    def __init__(self, path):
+        super().__init__(path, path)
+        self._stream_header = self._read_raw(0, 12)
+        self._data_end = os.path.getsize(path)
+        blocks = self._parse_index()
+        self._indexed = blocks is not None
+        if self._indexed:
+            uoff = 0
+            for coff, usize in blocks:
+                self._add_point(uoff, coff)
+                uoff += usize
+            self.size = uoff
+        else:
+            self._add_point(0, 0)
+
+    def _parse_index(self):
+        """解析单个流的索引，返回 [(块压缩偏移, 块解压长度)]，无法解析时返回None"""
+        footer = self._read_raw(self._data_end - 12, 12)
+        if len(footer) != 12 or footer[10:] != b"YZ":
+            return None
+        backward_size = (struct.unpack("<I", footer[4:8])[0] + 1) * 4
+        index_start = self._data_end - 12 - backward_size
+        index = self._read_raw(index_start, backward_size)
+        if len(index) != backward_size or index[0] != 0:
+            return None
+
+        pos = 1
+
+        def varint():
+            nonlocal pos
+            value = shift = 0
+            while True:
+                byte = index[pos]
+                pos += 1
+                value |= (byte & 0x7F) << shift
+                shift += 7
+                if not byte & 0x80:
+                    return value
+
+        try:
+            count = varint()
+            blocks = []
+            coff = 12
+            for _ in range(count):
+                unpadded, usize = varint(), varint()
+                blocks.append((coff, usize))
+                coff += (unpadded + 3) & ~3
+        except IndexError:
+            return None
+        if coff != index_start or not blocks:
+            # 多个流拼接等情况，退回到从头顺序解压
+            return None
+        self._data_end = index_start
+        return blocks
+
+    def build_index(self, progress=None):
+        if not self._indexed:
+            super().build_index(progress)
+
+    def single_block(self):
+        """整个文件只有一个块（xz默认压缩方式）时没有中间检查点，随机读取都要从头解压"""
+        return len(self.points) == 1 and self.size > self.CHECKPOINT_SPAN
+
+    def load_index(self, size, points):
+        if not self._indexed:
+            super().load_index(size, points)
+
+    def _restore(self, point):
+        uoff, coff, _ = point
+        cursor = _StreamCursor(uoff, coff, lzma.LZMADecompressor(lzma.FORMAT_XZ))
+        if coff > 0:
+            # 从块边界开始时补上流头，解码器会把后续数据当作新的块解析
+            cursor.decomp.decompress(self._stream_header)
+        return cursor
+
+    def _advance(self, cursor):
+        while True:
+            if cursor.decomp.eof:
+                # 多个流首尾相接：跳过流填充后继续解压下一个流
+                cursor.coff -= len(cursor.decomp.unused_data)
+                while True:
+                    peek = self._read_raw(cursor.coff, 4096)
+                    if not peek:
+                        return b""
+                    stripped = peek.lstrip(b"\0")
+                    cursor.coff += len(peek) - len(stripped)
+                    if stripped:
+                        break
+                cursor.decomp = lzma.LZMADecompressor(lzma.FORMAT_XZ)
+            data = b""
+            if cursor.decomp.needs_input:
+                data = self._read_raw(cursor.coff, min(self.READ_SIZE, self._data_end - cursor.coff))
+                if not data:
+                    return b""
+                cursor.coff += len(data)
+            out = cursor.decomp.decompress(data, self.OUT_SIZE)
+            if out:
+                return out
+
+
+class ZipMemberSource(DeflateSource):
+    """ZIP压缩包中的单个成员（存储或deflate压缩）"""
+
+    def __init__(self, path):
+        archive_path, member = path.split(ZIP_MEMBER_SEP, 1)
+        with zipfile.ZipFile(archive_path) as archive:
+            info = archive.getinfo(member)
+        if info.flag_bits & 0x01:
+            raise ValueError("不支持加密的ZIP成员")
+        if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise ValueError(f"不支持的ZIP压缩方式: {info.compress_type}")
+        with open(archive_path, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(30)
+        name_len, extra_len = struct.unpack("<HH", header[26:30])
+        data_start = info.header_offset + 30 + name_len + extra_len
+        super().__init__(path, archive_path, data_start, data_start + info.compress_size)
+        self.size = info.file_size
+        self._stored = info.compress_type == zipfile.ZIP_STORED
+
+    def build_index(self, progress=None):
+        if not self._stored:
+            super().build_index(progress)
+
+    def load_index(self, size, points):
+        if not self._stored:
+            super().load_index(size, points)
+
+    def _read_range(self, offset, size):
+        if self._stored:
+            return self._read_raw(self.points[0][1] + offset, size)
+        return super()._read_range(offset, size)
+
+
+ZIP_MEMBER_SEP = "::"
+SNAPSHOT_PREFIX = "snapshot:"
+DEVICE_PREFIX = "device:"  # 通过"打开设备"打开的路径，按块设备方式读取（也可以是磁盘镜像文件）
+
+
+class SnapshotSource(ByteSource):
+    """数据库中保存的文件快照版本
+
+    第一个版本保存全部块，之后的版本只保存与上一版本不同的块；
+    读取时每个块取不晚于本版本的最新保存，按需重建而不写出完整副本。
+    """
+    BLOCK_SIZE = ByteSource.PAGE_SIZE
+
+    def __init__(self, db_conn, path):
+        super().__init__(path)
+        self._db = db_conn
+        self.snapshot_id, self.file_path = self.parse_path(path)
+        row = self._db.execute(
+            "SELECT size FROM snapshots WHERE id = ? AND block_hashes IS NOT NULL", (self.snapshot_id,)
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"快照不存在: #{self.snapshot_id}")
+        self.size = row[0]
+        # 每个块在哪个版本中保存
+        self._block_owner = dict(self._db.execute(
+            "SELECT b.block_no, MAX(b.snapshot_id) FROM snapshot_blocks b "
+            "JOIN snapshots s ON s.id = b.snapshot_id "
+            "WHERE s.file_path = ? AND s.id <= ? AND s.block_hashes IS NOT NULL GROUP BY b.block_no",
+            (self.file_path, self.snapshot_id)
+        ))
+
+    @staticmethod
+    def make_path(snapshot_id, file_path):
+        return f"{SNAPSHOT_PREFIX}{snapshot_id}:{file_path}"
+
+    @staticmethod
+    def parse_path(path):
+        snapshot_id, file_path = path[len(SNAPSHOT_PREFIX):].split(":", 1)
+        return int(snapshot_id), file_path
+
+    @classmethod
+    def capture(cls, db_conn, source, file_path):
+        """保存数据源当前内容为新快照，返回 (快照ID, 保存的块数)"""
+        # 快照行、块和块哈希在同一个事务中写入，读取失败时整体回滚，不留下不完整的快照
+        with db_conn:
+            previous = db_conn.execute(
+                "SELECT block_hashes FROM snapshots WHERE file_path = ? AND block_hashes IS NOT NULL "
+                "ORDER BY id DESC LIMIT 1",
+                (file_path,)
+            ).fetchone()
+            previous_hashes = previous[0] if previous else b""
+            
+            cursor = db_conn.execute("INSERT INTO snapshots (file_path, size) VALUES (?, ?)", (file_path, len(source)))
+            snapshot_id = cursor.lastrowid
+            hashes = []
+            stored = 0
+            for block_no, offset in enumerate(range(0, len(source), cls.BLOCK_SIZE)):
+                data = source.read(offset, cls.BLOCK_SIZE)
+                digest = hashlib.blake2b(data, digest_size=16).digest()
+                hashes.append(digest)
+                if previous_hashes[block_no * 16:(block_no + 1) * 16] != digest:
+                    db_conn.execute(
+                        "INSERT INTO snapshot_blocks (snapshot_id, block_no, data) VALUES (?, ?, ?)",
+                        (snapshot_id, block_no, data)
+                    )
+                    stored += 1
+            db_conn.execute("UPDATE snapshots SET block_hashes = ? WHERE id = ?", (b"".join(hashes), snapshot_id))
+        return snapshot_id, stored
+
+    def _read_range(self, offset, size):
+        parts = []
+        end = offset + size
+        for block_no in range(offset // self.BLOCK_SIZE, (end - 1) // self.BLOCK_SIZE + 1):
+            row = self._db.execute(
+                "SELECT data FROM snapshot_blocks WHERE snapshot_id = ? AND block_no = ?",
+                (self._block_owner[block_no], block_no)
+            ).fetchone()
+            block_start = block_no * self.BLOCK_SIZE
+            parts.append(row[0][max(0, offset - block_start):end - block_start])
+        return b"".join(parts)
+
+
+class ByteRanges:
+    """有序且互不重叠的字节区间集合 [(起始, 结束)]"""
+
+    def __init__(self, ranges=()):
+        self.ranges = []
+        for start, end in sorted(ranges):
+            if end <= start:
+                continue
+            if self.ranges and start <= self.ranges[-1][1]:
+                if end > self.ranges[-1][1]:
+                    self.ranges[-1] = (self.ranges[-1][0], end)
+            else:
+                self.ranges.append((start, end))
+        self._starts = [start for start, _ in self.ranges]
+        self._total = sum(end - start for start, end in self.ranges)
+
+    def __len__(self):
+        return self._total
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def __contains__(self, pos):
+        i = bisect.bisect_right(self._starts, pos) - 1
+        return i >= 0 and pos < self.ranges[i][1]
+
+    def overlaps(self, start, end):
+        """[start, end) 是否与集合中的任一区间相交"""
+        if end <= start:
+            return False
+        i = bisect.bisect_right(self._starts, end - 1) - 1
+        return i >= 0 and self.ranges[i][1] > start
+
+    def union(self, other):
+        return ByteRanges(self.ranges + other.ranges)
+
+    def intersect(self, other):
+        return self.subtract(self.subtract(other))
+
+    def subtract(self, other):
+        """返回去掉other中区间后的集合，两个有序区间列表线性合并"""
+        result = []
+        others = other.ranges
+        j = 0
+        for start, end in self.ranges:
+            while j < len(others) and others[j][1] <= start:
+                j += 1
+            pos = start
+            k = j
+            while k < len(others) and others[k][0] < end:
+                if others[k][0] > pos:
+                    result.append((pos, others[k][0]))
+                pos = max(pos, others[k][1])
+                k += 1
+            if pos < end:
+                result.append((pos, end))
+        return ByteRanges(result)
+
+
+def find_all(source, pattern, start=0, end=None, chunk_size=1024 * 1024):
+    """按块查找pattern在数据源中所有不重叠的出现位置"""
+    if not pattern:
+        raise ValueError("查找内容不能为空")
+    end = len(source) if end is None else min(end, len(source))
+    overlap = len(pattern) - 1
+    pos = start
+    while pos + len(pattern) <= end:
+        chunk = source.read(pos, min(chunk_size + overlap, end - pos))
+        next_pos = pos + max(1, len(chunk) - overlap)
+        i = chunk.find(pattern)
+        while i >= 0:
+            yield pos + i
+            next_pos = max(next_pos, pos + i + len(pattern))
+            i = chunk.find(pattern, i + len(pattern))
+        pos = next_pos
+
+
+class MaskProfile:
+    """比对忽略掩码：固定偏移区间，或以特征字节定位的区间
+
+    文本格式每行一条规则，#开头为注释：
+        range 起始 结束            忽略 [起始, 结束)
+        pattern 特征十六进制 偏移 长度   在每处特征出现位置+偏移处忽略指定长度
+    """
+
+    def __init__(self, name, rules):
+        self.name = name
+        self.rules = rules
+
+    @classmethod
+    def parse(cls, name, text):
+        rules = []
+        for line_no, line in enumerate(text.splitlines(), 1):
+            parts = line.split("#", 1)[0].split()
+            if not parts:
+                continue
+            try:
+                if parts[0] == "range" and len(parts) == 3:
+                    start, end = int(parts[1], 0), int(parts[2], 0)
+                    if end <= start:
+                        raise ValueError
+                    rules.append({"type": "range", "start": start, "end": end})
+                elif parts[0] == "pattern" and len(parts) == 4:
+                    pattern = bytes.fromhex(parts[1])
+                    length = int(parts[3], 0)
+                    if not pattern or length <= 0:
+                        raise ValueError
+                    rules.append({"type": "pattern", "pattern": pattern.hex(),
+                                  "offset": int(parts[2], 0), "length": length})
+                else:
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"第 {line_no} 行格式错误: {line.strip()}")
+        return cls(name, rules)
+
+    def to_text(self):
+        lines = []
+        for rule in self.rules:
+            if rule["type"] == "range":
+                lines.append(f"range 0x{rule['start']:X} 0x{rule['end']:X}")
+            else:
+                lines.append(f"pattern {rule['pattern']} {rule['offset']} {rule['length']}")
+        return "\n".join(lines)
+
+    def compile(self, source):
+        """把规则编译成该数据源上的忽略区间集合"""
+        ranges = []
+        for rule in self.rules:
+            if rule["type"] == "range":
+                ranges.append((rule["start"], rule["end"]))
+            else:
+                for pos in find_all(source, bytes.fromhex(rule["pattern"])):
+                    start = max(0, pos + rule["offset"])
+                    ranges.append((start, pos + rule["offset"] + rule["length"]))
+        return ByteRanges(ranges)
+
+
+def _intersect_runs(a, b):
+    """求两组单一字节区段中字节值相同部分的交集"""
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if start < end and a[i][2] == b[j][2]:
+            result.append((start, end, a[i][2]))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+_NONZERO_RUN = re.compile(rb"[^\x00]+")
+
+
+def compute_differences(sources, ranges=None, chunk_size=1024 * 1024):
+    """找出各数据源之间不一致的字节位置，返回ByteRanges
+
+    所有文件中字节值相同的单一字节区段（空洞、填充）直接跳过；
+    其余部分按块比较，块内差异通过整数异或后用正则查找非零字节。
+    ranges不为None时只比较其中的区间（编辑后局部更新）。
+    """
+    min_len = min(len(source) for source in sources)
+    max_len = max(len(source) for source in sources)
+    if ranges is None:
+        ranges = ByteRanges([(0, max_len)])
+    tail = ByteRanges([(min_len, max_len)])
+    diffs = list(ranges.intersect(tail))
+    
+    common_runs = sources[0].runs()
+    for source in sources[1:]:
+        common_runs = _intersect_runs(common_runs, source.runs())
+    
+    # 需要逐块比较的区间 = 目标区间减去公共区段和长度不等的尾部
+    gaps = ranges.subtract(ByteRanges([(start, end) for start, end, _ in common_runs])).subtract(tail)
+    
+    base, others = sources[0], sources[1:]
+    for gap_start, gap_end in gaps:
+        for pos in range(gap_start, gap_end, chunk_size):
+            size = min(chunk_size, gap_end - pos)
+            base_chunk = base.read(pos, size)
+            xor = 0
+            for source in others:
+                chunk = source.read(pos, size)
+                if chunk != base_chunk:
+                    xor |= int.from_bytes(base_chunk, "big") ^ int.from_bytes(chunk, "big")
+            if xor:
+                for match in _NONZERO_RUN.finditer(xor.to_bytes(size, "big")):
+                    diffs.append((pos + match.start(), pos + match.end()))
+    return ByteRanges(diffs)
+
+
+def repeat_pattern(pattern, phase, length):
+    """从pattern的第phase个字节开始循环，生成length字节"""
+    count = (phase + length) // len(pattern) + 1
+    return (pattern * count)[phase:phase + length]
+
+
+def transform_bytes(data, op, operand, phase=0):
+    """对data整体做XOR/加/减变换，operand按位置循环使用"""
+    if op == "xor":
+        key = repeat_pattern(operand, phase, len(data))
+        return (int.from_bytes(data, "big") ^ int.from_bytes(key, "big")).to_bytes(len(data), "big")
+    if len(operand) != 1:
+        raise ValueError("加减运算只支持单字节操作数")
+    delta = operand[0] if op == "add" else -operand[0]
+    return data.translate(bytes((i + delta) & 0xFF for i in range(256)))
+
+
+EXPORT_FORMATS = {
+    "hex": "十六进制（空格分隔）",
+    "c": "C数组",
+    "python": "Python字节串",
+    "base64": "Base64",
+    "raw": "原始字节",
+}
+
+
+def iter_export_chunks(source, start, end, fmt, chunk_size=1024 * 1024):
+    """按块生成 [start, end) 范围的导出内容，raw格式生成bytes，其余生成str"""
+    if fmt == "base64":
+        # 57字节正好编码为一行76个字符，块之间不会断行
+        chunk_size -= chunk_size % 57
+    elif fmt != "raw":
+        chunk_size -= chunk_size % 16
+    if fmt == "c":
+        yield f"unsigned char data[{end - start}] = {{\n"
+    elif fmt == "python":
+        yield "data = bytes([\n"
+    
+    for pos in range(start, end, chunk_size):
+        chunk = source.read(pos, min(chunk_size, end - pos))
+        if fmt == "raw":
+            yield chunk
+        elif fmt == "base64":
+            yield base64.encodebytes(chunk).decode("ascii")
+        else:
+            # 每行16字节，整块一次转换后按行切分
+            text = chunk.hex(" ")
+            lines = [text[i:i + 47] for i in range(0, len(text), 48)]
+            if fmt == "hex":
+                yield "\n".join(lines) + "\n"
+            else:
+                yield "".join(f"    0x{line.replace(' ', ', 0x')},\n" for line in lines)
+    
+    if fmt == "c":
+        yield "};\n"
+    elif fmt == "python":
+        yield "])\n"
+
+
+def open_compressed_source(path):
+    """按扩展名和文件头识别压缩文件，返回对应的数据源，普通文件返回None"""
+    if ZIP_MEMBER_SEP in path:
+        return ZipMemberSource(path)
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in (".gz", ".xz"):
+        return None
+    with open(path, 'rb') as f:
+        magic = f.read(6)
+    if ext == ".gz" and magic[:2] == b"\x1f\x8b":
+        return GzipSource(path)
+    if ext == ".xz" and magic == XzSource.MAGIC:
+        return XzSource(path)
+    return None
+
+
+class GlyphAtlas:
+    """预渲染字形图集：每种字体、单元格大小、设备像素比和背景色只绘制一次全部256个字形"""
+    
+    GLYPHS = {
+        "hex": [f"{byte:02X}" for byte in range(256)],
+        "ascii": [chr(byte) if 32 <= byte <= 126 else "." for byte in range(256)],
+    }
+    MAX_STRIPS = 64  # 字体或DPI多次变化后丢弃旧图集，避免无限增长
+    
+    def __init__(self):
+        self._strips = {}
+        self.builds = 0
+    
+    def strip(self, kind, font, cell_width, cell_height, ratio, background):
+        """返回一条横向排列256个字形的图片，第N个单元格就是字节N的字形"""
+        key = (kind, font.key(), cell_width, cell_height, ratio, background.rgba())
+        pixmap = self._strips.get(key)
+        if pixmap is None:
+            if len(self._strips) >= self.MAX_STRIPS:
+                self._strips.clear()
+            pixmap = QPixmap(round(256 * cell_width * ratio), round(cell_height * ratio))
+            pixmap.setDevicePixelRatio(ratio)
+            pixmap.fill(background)
+            painter = QPainter(pixmap)
+            painter.setFont(font)
+            painter.setPen(QColor(Qt.black))
+            for byte, text in enumerate(self.GLYPHS[kind]):
+                painter.drawText(QRect(byte * cell_width, 0, cell_width, cell_height), Qt.AlignCenter, text)
+            painter.end()
+            self._strips[key] = pixmap
+            self.builds += 1
+        return pixmap
+    
+    def clear(self):
+        self._strips.clear()
+
+
+glyph_atlas = GlyphAtlas()
+
+
+class HexPane(QAbstractScrollArea):
+    """一个文件的十六进制视图，只绘制可见的行
+
+    每次绘制时通过数据源（页缓存）读取可见行的数据，单元格从字形图集贴图，
+    不为每行或每个字节创建控件。垂直滚动条以行为单位，折叠的单一字节区段占一行。
+    """
+    
+    BYTES_PER_LINE = 16
+    MARGIN = 5
+    ADDRESS_WIDTH = 80
+    COLUMN_SPACING = 10
+    HEX_CELL_WIDTH = 20
+    HEX_PITCH = 25
+    ASCII_CELL_WIDTH = 12
+    SCROLL_LIMIT = 1 << 30  # 行数超过滚动条取值范围时按比例缩放
+    
+    byte_clicked = pyqtSignal(object, bool)  # 偏移, 是否扩展选区
+    byte_edited = pyqtSignal(object, int)  # 偏移, 新字节值
+    run_toggled = pyqtSignal(object)  # 单一字节区段的偏移
+    top_row_changed = pyqtSignal(object)  # 顶部行号
+    
+    def __init__(self, source, color_for, line_highlighted):
+        super().__init__()
+        self.source = source
+        self.color_for = color_for  # 偏移 -> 单元格背景QColor
+        self.line_highlighted = line_highlighted  # (起始, 结束) -> 是否高亮整行
+        self.editable = False
+        self.cursor = None  # 编辑模式下输入的字节偏移
+        self.low_nibble = False  # 下一次输入的是否为低4位
+        self.row_scale = 1
+        self.hex_x = self.MARGIN + self.ADDRESS_WIDTH + self.COLUMN_SPACING
+        self.ascii_x = self.hex_x + self.BYTES_PER_LINE * self.HEX_PITCH - 5 + self.COLUMN_SPACING
+        self.content_width = self.ascii_x + self.BYTES_PER_LINE * self.ASCII_CELL_WIDTH + self.MARGIN
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.verticalScrollBar().valueChanged.connect(
+            lambda value: self.top_row_changed.emit(self.top_row())
+        )
+        self.horizontalScrollBar().valueChanged.connect(lambda _: self.viewport().update())
+        self.update_metrics()
+        self.set_runs([], set())
+    
+    def update_metrics(self):
+        self.row_height = QFontMetrics(self.font()).height() + 4
+        self.setMinimumWidth(self.content_width + self.verticalScrollBar().sizeHint().width() + 2 * self.frameWidth())
+        self.update_scroll_range()
+    
+    def set_runs(self, runs, expanded):
+        """按折叠的单一字节区段重新划分行，保持顶部显示的偏移不变"""
+        top_offset = self.row_offset(self.top_row()) if hasattr(self, "_segments") else 0
+        per_line = self.BYTES_PER_LINE
+        total_lines = (len(self.source) + per_line - 1) // per_line
+        # 行段: (首行号, 首个数据行, 类型, 参数)；"lines"段参数为行数，"run"段为 (长度, 字节值, 是否展开)
+        segments = []
+        row = line = 0
+        for run_start, run_end, value in runs:
+            first_line = (run_start + per_line - 1) // per_line
+            last_line = min(run_end // per_line, total_lines)
+            if last_line <= max(first_line, line):
+                continue
+            if first_line > line:
+                segments.append((row, line, "lines", first_line - line))
+                row += first_line - line
+            is_expanded = first_line * per_line in expanded
+            segments.append((row, first_line, "run", ((last_line - first_line) * per_line, value, is_expanded)))
+            row += 1
+            if is_expanded:
+                segments.append((row, first_line, "lines", last_line - first_line))
+                row += last_line - first_line
+            line = last_line
+        if total_lines > line:
+            segments.append((row, line, "lines", total_lines - line))
+            row += total_lines - line
+        self._segments = segments
+        self._segment_rows = [segment[0] for segment in segments]
+        self._segment_lines = [segment[1] for segment in segments]
+        self.total_rows = row
+        self.update_scroll_range()
+        self.set_top_row(self.offset_row(top_offset))
+        self.viewport().update()
+    
+    def row_info(self, row):
+        """返回 (类型, 偏移, 跨度, 参数)；数据行跨度为16，折叠区段为区段长度，展开的区段标题为0"""
+        first_row, first_line, kind, arg = self._segments[bisect.bisect_right(self._segment_rows, row) - 1]
+        if kind == "lines":
+            return kind, (first_line + row - first_row) * self.BYTES_PER_LINE, self.BYTES_PER_LINE, arg
+        length, value, is_expanded = arg
+        return kind, first_line * self.BYTES_PER_LINE, 0 if is_expanded else length, arg
+    
+    def row_offset(self, row):
+        return self.row_info(row)[1] if self._segments and row < self.total_rows else 0
+    
+    def offset_row(self, offset):
+        """包含该偏移的行号，落在折叠区段内时返回区段所在行"""
+        if not self._segments:
+            return 0
+        line = offset // self.BYTES_PER_LINE
+        i = max(bisect.bisect_right(self._segment_lines, line) - 1, 0)
+        first_row, first_line, kind, arg = self._segments[i]
+        if kind == "run":
+            return first_row
+        return first_row + min(line - first_line, arg - 1)
+    
+    def visible_rows(self):
+        return max(1, self.viewport().height() // self.row_height)
+    
+    def update_scroll_range(self):
+        if not hasattr(self, "total_rows"):
+            return
+        max_row = max(0, self.total_rows - self.visible_rows())
+        self.row_scale = max(1, -(-max_row // self.SCROLL_LIMIT))
+        v_bar = self.verticalScrollBar()
+        v_bar.setRange(0, -(-max_row // self.row_scale))
+        v_bar.setPageStep(max(1, self.visible_rows() // self.row_scale))
+        h_bar = self.horizontalScrollBar()
+        h_bar.setRange(0, max(0, self.content_width - self.viewport().width()))
+        h_bar.setPageStep(self.viewport().width())
+    
+    def top_row(self):
+        return min(self.verticalScrollBar().value() * self.row_scale, max(0, self.total_rows - 1))
+    
+    def set_top_row(self, row):
+        self.verticalScrollBar().setValue(row // self.row_scale)
+    
+    def update_range(self, start, end):
+        """[start, end) 与可见行相交时重绘"""
+        top = self.top_row()
+        for row in range(top, min(top + self.visible_rows() + 1, self.total_rows)):
+            _, offset, span, _ = self.row_info(row)
+            if offset < end and offset + max(span, 1) > start:
+                self.viewport().update()
+                return
+    
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.update_scroll_range()
+    
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+    
+    def changeEvent(self, event):
+        # 字体变化时重新计算行高，图集按新字体的键自动重建
+        if event.type() == QEvent.FontChange:
+            self.update_metrics()
+            self.viewport().update()
+        super().changeEvent(event)
+    
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        painter.fillRect(event.rect(), QColor(Qt.white))
+        font = self.font()
+        painter.setFont(font)
+        ratio = self.viewport().devicePixelRatioF()
+        height = self.row_height
+        left = -self.horizontalScrollBar().value()
+        top = self.top_row()
+        strips = {}  # 本次绘制用到的图集: 背景色 -> (十六进制, ASCII)
+        first = top + max(event.rect().top(), 0) // height
+        last = min(top + event.rect().bottom() // height + 1, self.total_rows)
+        for row in range(first, last):
+            kind, offset, span, arg = self.row_info(row)
+            y = (row - top) * height
+            if self.line_highlighted(offset, offset + span):
+                painter.fillRect(0, y, self.viewport().width(), height, QColor(255, 255, 200))
+            painter.setPen(QColor(Qt.black))
+            painter.drawText(QRect(left + self.MARGIN, y, self.ADDRESS_WIDTH, height),
+                             Qt.AlignRight | Qt.AlignVCenter, f"{offset:08X}")
+            if kind == "run":
+                length, value, is_expanded = arg
+                action = "▼ 折叠" if is_expanded else "▶"
+                label_rect = QRect(left + self.hex_x, y + 1, self.content_width - self.hex_x - self.MARGIN, height - 2)
+                painter.fillRect(label_rect, QColor(MacaronColors.LILAC_MIST))
+                painter.drawText(label_rect.adjusted(4, 0, 0, 0), Qt.AlignLeft | Qt.AlignVCenter,
+                                 f"{action} {length} 字节的 0x{value:02X}")
+                continue
+            # 数据在绘制时才通过页缓存读取
+            data = self.source.read(offset, self.BYTES_PER_LINE)
+            for i, byte in enumerate(data):
+                background = self.color_for(offset + i)
+                pair = strips.get(background.rgba())
+                if pair is None:
+                    pair = strips[background.rgba()] = (
+                        glyph_atlas.strip("hex", font, self.HEX_CELL_WIDTH, height, ratio, background),
+                        glyph_atlas.strip("ascii", font, self.ASCII_CELL_WIDTH, height, ratio, background),
+                    )
+                for strip, x, width in ((pair[0], self.hex_x + i * self.HEX_PITCH, self.HEX_CELL_WIDTH),
+                                        (pair[1], self.ascii_x + i * self.ASCII_CELL_WIDTH, self.ASCII_CELL_WIDTH)):
+                    painter.drawPixmap(QRectF(left + x, y, width, height), strip,
+                                       QRectF(byte * width * ratio, 0, width * ratio, height * ratio))
+                if self.editable and self.cursor == offset + i:
+                    painter.drawRect(left + self.hex_x + i * self.HEX_PITCH, y, self.HEX_CELL_WIDTH - 1, height - 1)
+        painter.end()
+    
+    def hit_test(self, point):
+        """返回 (类型, 偏移)：点击的是字节单元格或单一字节区段行，否则返回None"""
+        row = self.top_row() + point.y() // self.row_height
+        if point.y() < 0 or row >= self.total_rows:
+            return None
+        kind, offset, span, _ = self.row_info(row)
+        x = point.x() + self.horizontalScrollBar().value()
+        if kind == "run":
+            return (kind, offset) if x >= self.hex_x else None
+        for start, pitch, width in ((self.hex_x, self.HEX_PITCH, self.HEX_CELL_WIDTH),
+                                    (self.ascii_x, self.ASCII_CELL_WIDTH, self.ASCII_CELL_WIDTH)):
+            index = (x - start) // pitch
+            if 0 <= index < self.BYTES_PER_LINE and x - start - index * pitch < width:
+                pos = offset + index
+                return ("byte", pos) if pos < len(self.source) else None
+        return None
+    
+    def mousePressEvent(self, event):
+        # 点击十六进制或ASCII单元格选择字节，按住Shift点击扩展选区；点击区段行展开或折叠
+        hit = self.hit_test(event.pos()) if event.button() == Qt.LeftButton else None
+        if hit is None:
+            super().mousePressEvent(event)
+        elif hit[0] == "run":
+            self.run_toggled.emit(hit[1])
+        else:
+            self.byte_clicked.emit(hit[1], bool(event.modifiers() & Qt.ShiftModifier))
+    
+    def set_cursor(self, pos):
+        self.cursor = pos
+        self.low_nibble = False
+        self.viewport().update()
+    
+    def keyPressEvent(self, event):
+        # 编辑模式下输入两位十六进制数字修改光标处字节，输入完成后移到下一个字节
+        text = event.text()
+        if not (self.editable and self.cursor is not None and len(text) == 1 and text in "0123456789abcdefABCDEF"):
+            super().keyPressEvent(event)
+            return
+        digit = int(text, 16)
+        old = self.source[self.cursor]
+        pos = self.cursor
+        if self.low_nibble:
+            self.byte_edited.emit(pos, (old & 0xF0) | digit)
+            if pos + 1 < len(self.source):
+                self.byte_clicked.emit(pos + 1, False)
+        else:
+            self.byte_edited.emit(pos, (digit << 4) | (old & 0x0F))
+            self.low_nibble = True
+
+
 class HexViewer(QMainWindow):
+    CLIPBOARD_LIMIT = 16 * 1024 * 1024  # 超过该大小的选区只能导出到文件
+    EDIT_CHUNK = 1024 * 1024  # 批量编辑每次处理的块大小
+    UNDO_LIMIT = 20  # 保留的撤销步骤数
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle(f"{ProjectInfo.NAME} {ProjectInfo.VERSION} (Build: {ProjectInfo.BUILD_DATE})")
@@ -78,6 +1484,10 @@ class HexViewer(QMainWindow):
         # 初始化数据库
         self.init_db()
         
+        # 页缓存内存预算
+        page_cache.set_budget(int(self.get_db_setting("cache_budget_mb", 256)) * 1024 * 1024)
+        page_cache.readahead_pages = max(1, int(self.get_db_setting("readahead_kb", 1024)) * 1024 // PageCache.PAGE_SIZE)
+        
         # 设置图标
         if os.path.exists("icon.ico"):
             self.setWindowIcon(QIcon("icon.ico"))
@@ -87,6 +1497,7 @@ class HexViewer(QMainWindow):
         
         # 加载上次的设置
         self.load_settings()
+        self.load_mask_profiles()
     
     def init_db(self):
         self.db_conn = sqlite3.connect("hexviewer_settings.db")
@@ -109,6 +1520,54 @@ class HexViewer(QMainWindow):
         )
         """)
         
+        # 创建文件快照表（块数据只保存与上一版本不同的部分）
+        self.db_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_path TEXT,
+            created TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            size INTEGER,
+            block_hashes BLOB
+        )
+        """)
+        self.db_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS snapshot_blocks (
+            snapshot_id INTEGER,
+            block_no INTEGER,
+            data BLOB,
+            PRIMARY KEY (snapshot_id, block_no)
+        )
+        """)
+        
+        # 创建比对忽略掩码表
+        self.db_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS mask_profiles (
+            name TEXT PRIMARY KEY,
+            rules TEXT
+        )
+        """)
+        
+        # 创建压缩文件检查点索引表
+        self.db_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS compressed_index (
+            file_path TEXT PRIMARY KEY,
+            file_size INTEGER,
+            file_mtime REAL,
+            data_size INTEGER,
+            points TEXT
+        )
+        """)
+        
+        self.db_conn.commit()
+    
+    def get_db_setting(self, key, default=None):
+        """从数据库设置表中读取配置"""
+        row = self.db_cursor.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+    
+    def set_db_setting(self, key, value):
+        """写入配置到数据库设置表"""
+        self.db_cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
         self.db_conn.commit()
     
     def init_ui(self):
@@ -129,6 +1588,10 @@ class HexViewer(QMainWindow):
         self.open_button.clicked.connect(self.open_files)
         button_layout.addWidget(self.open_button)
         
+        self.device_button = QPushButton("打开设备")
+        self.device_button.clicked.connect(self.open_device)
+        button_layout.addWidget(self.device_button)
+        
         self.clear_button = QPushButton("清除所有")
         self.clear_button.clicked.connect(self.clear_all)
         button_layout.addWidget(self.clear_button)
@@ -148,6 +1611,46 @@ class HexViewer(QMainWindow):
         self.multi_compare_button.clicked.connect(self.compare_multiple_files)
         self.multi_compare_button.setEnabled(False)
         button_layout.addWidget(self.multi_compare_button)
+        
+        # 比对忽略掩码
+        self.mask_combo = QComboBox()
+        self.mask_combo.setToolTip("比对时忽略的掩码配置")
+        self.mask_combo.currentIndexChanged.connect(self.mask_profile_changed)
+        button_layout.addWidget(self.mask_combo)
+        
+        self.mask_button = QPushButton("编辑掩码")
+        self.mask_button.clicked.connect(self.edit_mask_profile)
+        button_layout.addWidget(self.mask_button)
+        
+        self.bulk_edit_button = QPushButton("批量编辑")
+        self.bulk_edit_button.clicked.connect(self.bulk_edit)
+        button_layout.addWidget(self.bulk_edit_button)
+        
+        self.undo_button = QPushButton("撤销")
+        self.undo_button.setShortcut(QKeySequence.Undo)
+        self.undo_button.clicked.connect(self.undo_edit)
+        self.undo_button.setEnabled(False)
+        button_layout.addWidget(self.undo_button)
+        
+        self.copy_button = QPushButton("复制选区")
+        self.copy_button.clicked.connect(self.copy_selection)
+        button_layout.addWidget(self.copy_button)
+        
+        self.export_button = QPushButton("导出选区")
+        self.export_button.clicked.connect(self.export_selection)
+        button_layout.addWidget(self.export_button)
+        
+        self.snapshot_button = QPushButton("保存快照")
+        self.snapshot_button.clicked.connect(self.capture_snapshot)
+        button_layout.addWidget(self.snapshot_button)
+        
+        self.open_snapshot_button = QPushButton("打开快照")
+        self.open_snapshot_button.clicked.connect(self.open_snapshots)
+        button_layout.addWidget(self.open_snapshot_button)
+        
+        self.cache_button = QPushButton("缓存设置")
+        self.cache_button.clicked.connect(self.configure_cache)
+        button_layout.addWidget(self.cache_button)
     
         button_layout.addStretch()
         
@@ -193,18 +1696,37 @@ class HexViewer(QMainWindow):
         self.status_label = QLabel("就绪")
         self.status_bar.addWidget(self.status_label)
         
+        # 页缓存命中统计
+        self.cache_label = QLabel(page_cache.stats_text())
+        self.status_bar.addPermanentWidget(self.cache_label)
+        self.scan_label = QLabel()  # 后台区段扫描进度
+        self.status_bar.addPermanentWidget(self.scan_label)
+        self.cache_timer = QTimer(self)
+        self.cache_timer.timeout.connect(self.update_cache_status)
+        self.cache_timer.start(1000)
+        
         # 存储文件数据
         self.file_data = {}
         self.current_file_index = -1
         self.hex_views = {}
-        self.scroll_areas = {}
-        self.byte_widgets = {}  # 存储字节编辑控件
+        self.hex_panes = {}  # 每个文件的十六进制窗格: 文件路径 -> HexPane
+        self.expanded_runs = set()  # 已展开的单一字节区段偏移，所有窗格共用
+        self.view_runs = []  # 所有窗格共有、视图中折叠显示的单一字节区段
+        self.selection = None  # 选区 (文件路径, 锚点偏移, 当前偏移)
+        self.undo_stack = []  # 批量编辑的撤销步骤，每步为 [(文件路径, 偏移, 原数据)]
+        self.compared = False  # 是否已经比对过，编辑后需要局部更新差异
+        self.differences = ByteRanges()  # 最近一次比对的差异区间
+        self.mask_cache = {}  # 编译后的掩码: (掩码名, 文件路径) -> ByteRanges
         
         # 滚动条同步相关
-        self.scroll_bars = []
         self.h_scroll_bars = []
         self.scroll_sync_enabled = True
         self.edit_mode = False
+        
+        # 打开文件后在界面空闲时分段扫描单一字节区段，不阻塞打开
+        self.run_scans = {}  # 文件路径 -> 扫描生成器
+        self.run_scan_timer = QTimer(self)
+        self.run_scan_timer.timeout.connect(self.scan_runs_step)
     
     def load_settings(self):
         # 恢复窗口大小和位置
@@ -251,15 +1773,24 @@ class HexViewer(QMainWindow):
     
     def add_file(self, file_path):
         try:
-            file_info = QFileInfo(file_path)
-            file_name = file_info.fileName()
-            file_size = file_info.size()
+            # ZIP压缩包需要先选择成员
+            if ZIP_MEMBER_SEP not in file_path and file_path.lower().endswith(".zip") \
+                    and zipfile.is_zipfile(file_path):
+                file_path = self.select_zip_member(file_path)
+                if not file_path:
+                    return
+            
+            file_name = self.display_name(file_path)
             
             # 检查是否已添加
             for i in range(self.file_list_widget.rowCount()):
                 if self.file_list_widget.item(i, 2).text() == file_path:
                     return
             
+            # 读取文件内容（按需读取，不整个读入内存）
+            self.file_data[file_path] = self.open_source(file_path)
+            file_size = len(self.file_data[file_path])
+            
             # 添加到文件列表
             row = self.file_list_widget.rowCount()
             self.file_list_widget.insertRow(row)
@@ -268,11 +1799,6 @@ class HexViewer(QMainWindow):
             self.file_list_widget.setItem(row, 1, QTableWidgetItem(self.format_size(file_size)))
             self.file_list_widget.setItem(row, 2, QTableWidgetItem(file_path))
             
-            # 读取文件内容
-            with open(file_path, 'rb') as f:
-                content = f.read()
-                self.file_data[file_path] = bytearray(content)
-            
             # 添加到数据库历史记录
             self.db_cursor.execute(
                 "INSERT OR REPLACE INTO file_history (file_path) VALUES (?)",
@@ -280,6 +1806,13 @@ class HexViewer(QMainWindow):
             )
             self.db_conn.commit()
             
+            # 区段扫描完成之前各窗格都不折叠，保证行号对齐
+            if not self.file_data[file_path].runs_ready():
+                self.run_scans[file_path] = self.file_data[file_path].scan_runs()
+                self.run_scan_timer.start(0)
+            if self.update_view_runs():
+                self.update_hex_layouts()
+            
             # 创建十六进制视图
             self.create_hex_view(file_path)
         
@@ -292,6 +1825,179 @@ class HexViewer(QMainWindow):
         except Exception as e:
             QMessageBox.warning(self, "错误", f"无法打开文件 {file_path}:\n{str(e)}")
     
+    def open_source(self, file_path):
+        """根据路径类型创建数据源"""
+        if file_path.startswith(SNAPSHOT_PREFIX):
+            return SnapshotSource(self.db_conn, file_path)
+        if file_path.startswith(DEVICE_PREFIX):
+            return BlockDeviceSource(file_path[len(DEVICE_PREFIX):])
+        # 压缩文件按检查点索引按需解压
+        source = self.open_compressed_file(file_path)
+        if source is not None:
+            return source
+        if BlockDeviceSource.is_device(file_path):
+            return BlockDeviceSource(file_path)
+        return FileSource(file_path)
+    
+    def display_name(self, file_path):
+        """文件列表和视图标题中显示的名称"""
+        if file_path.startswith(SNAPSHOT_PREFIX):
+            snapshot_id, path = SnapshotSource.parse_path(file_path)
+            return f"{QFileInfo(path).fileName()} (快照 #{snapshot_id})"
+        if file_path.startswith(DEVICE_PREFIX):
+            return f"{QFileInfo(file_path[len(DEVICE_PREFIX):]).fileName()} (设备)"
+        return QFileInfo(file_path).fileName()
+    
+    def capture_snapshot(self):
+        """保存选中文件当前在磁盘上的内容为新快照"""
+        paths = [path for path in self.file_data if not path.startswith(SNAPSHOT_PREFIX)]
+        if not paths:
+            QMessageBox.warning(self, "警告", "请先打开要保存快照的文件")
+            return
+        
+        selected = self.file_list_widget.currentRow()
+        current = self.file_list_widget.item(selected, 2).text() if selected >= 0 else ""
+        file_path, ok = QInputDialog.getItem(
+            self, "保存快照", "选择文件:", paths, paths.index(current) if current in paths else 0, False
+        )
+        if not ok:
+            return
+        
+        try:
+            # 重新从磁盘读取，而不是使用已编辑的内容
+            self.status_label.setText(f"正在保存 {os.path.basename(file_path)} 的快照...")
+            QApplication.processEvents()
+            source = self.open_source(file_path)
+            try:
+                snapshot_id, stored = SnapshotSource.capture(self.db_conn, source, file_path)
+            finally:
+                source.close()
+            total = (len(source) + SnapshotSource.BLOCK_SIZE - 1) // SnapshotSource.BLOCK_SIZE
+            self.status_label.setText(f"快照 #{snapshot_id} 已保存，{total} 个块中保存了 {stored} 个变化块")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"保存快照失败: {str(e)}")
+    
+    def open_snapshots(self):
+        """选择同一文件的两个快照作为比对窗格打开"""
+        paths = [row[0] for row in self.db_cursor.execute(
+            "SELECT DISTINCT file_path FROM snapshots WHERE block_hashes IS NOT NULL ORDER BY file_path"
+        )]
+        if not paths:
+            QMessageBox.warning(self, "警告", "数据库中还没有快照")
+            return
+        file_path, ok = QInputDialog.getItem(self, "打开快照", "选择文件:", paths, 0, False)
+        if not ok:
+            return
+        
+        snapshots = self.db_cursor.execute(
+            "SELECT id, created, size FROM snapshots WHERE file_path = ? AND block_hashes IS NOT NULL ORDER BY id",
+            (file_path,)
+        ).fetchall()
+        labels = [f"#{sid}  {created}  {self.format_size(size)}" for sid, created, size in snapshots]
+        chosen = []
+        for title in ("选择第一个快照:", "选择第二个快照:"):
+            label, ok = QInputDialog.getItem(self, "打开快照", title, labels, max(0, len(labels) - 1), False)
+            if not ok:
+                return
+            chosen.append(snapshots[labels.index(label)][0])
+        
+        for snapshot_id in chosen:
+            self.add_file(SnapshotSource.make_path(snapshot_id, file_path))
+    
+    def open_device(self):
+        """打开原始块设备、分区（如 /dev/sdb1）或大型磁盘镜像，按扇区对齐读取"""
+        path, ok = QInputDialog.getText(self, "打开设备", "设备或磁盘镜像路径:")
+        path = path.strip()
+        if not ok or not path:
+            return
+        self.add_file(DEVICE_PREFIX + path)
+    
+    def select_zip_member(self, archive_path):
+        """选择要打开的ZIP成员，返回 "压缩包路径::成员名"，取消时返回None"""
+        with zipfile.ZipFile(archive_path) as archive:
+            members = [info.filename for info in archive.infolist() if not info.is_dir()]
+        if not members:
+            raise ValueError("压缩包中没有文件")
+        if len(members) == 1:
+            member = members[0]
+        else:
+            member, ok = QInputDialog.getItem(
+                self, "选择ZIP成员", os.path.basename(archive_path), members, 0, False
+            )
+            if not ok:
+                return None
+        return f"{archive_path}{ZIP_MEMBER_SEP}{member}"
+    
+    def open_compressed_file(self, file_path):
+        """打开压缩文件，优先使用数据库中保存的检查点索引"""
+        source = open_compressed_source(file_path)
+        if source is None:
+            return None
+        
+        stat = os.stat(source.container_path)
+        row = self.db_cursor.execute(
+            "SELECT file_size, file_mtime, data_size, points FROM compressed_index WHERE file_path = ?",
+            (file_path,)
+        ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            source.load_index(row[2], json.loads(row[3]))
+        else:
+            # 首次打开时流式解压一遍建立索引，显示进度并允许取消
+            progress_dialog = QProgressDialog(
+                f"正在为 {os.path.basename(file_path)} 建立检查点索引...", "取消", 0, 1000, self
+            )
+            progress_dialog.setWindowModality(Qt.WindowModal)
+            progress_dialog.setMinimumDuration(500)
+            
+            def report(done, total):
+                progress_dialog.setValue(min(999, done * 1000 // max(total, 1)))
+                QApplication.processEvents()
+                return not progress_dialog.wasCanceled()
+            
+            try:
+                source.build_index(report)
+            except Exception:
+                source.close()
+                raise
+            finally:
+                progress_dialog.close()
+            self.db_cursor.execute(
+                "INSERT OR REPLACE INTO compressed_index (file_path, file_size, file_mtime, data_size, points) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (file_path, stat.st_size, stat.st_mtime, source.size, json.dumps(source.export_index()))
+            )
+            self.db_conn.commit()
+            self.status_label.setText("就绪")
+        if isinstance(source, XzSource) and source.single_block():
+            self.status_label.setText(
+                f"{os.path.basename(file_path)} 只有一个xz块，随机访问需要从头解压，"
+                "建议用 xz --block-size=4MiB 重新压缩"
+            )
+        return source
+    
+    def configure_cache(self):
+        """设置页缓存的内存上限和预读大小"""
+        budget_mb, ok = QInputDialog.getInt(
+            self, "缓存设置", "页缓存内存上限 (MB):",
+            page_cache.budget // (1024 * 1024), 16, 1024 * 1024
+        )
+        if not ok:
+            return
+        readahead_kb, ok = QInputDialog.getInt(
+            self, "缓存设置", "顺序读取时的预读大小 (KB):",
+            page_cache.readahead_pages * PageCache.PAGE_SIZE // 1024, 64, 256 * 1024, 64
+        )
+        if not ok:
+            return
+        page_cache.set_budget(budget_mb * 1024 * 1024)
+        page_cache.readahead_pages = max(1, readahead_kb * 1024 // PageCache.PAGE_SIZE)
+        self.set_db_setting("cache_budget_mb", budget_mb)
+        self.set_db_setting("readahead_kb", readahead_kb)
+        self.update_cache_status()
+    
+    def update_cache_status(self):
+        self.cache_label.setText(page_cache.stats_text())
+    
     def format_size(self, size):
         # 格式化文件大小显示
         for unit in ['B', 'KB', 'MB', 'GB']:
@@ -324,11 +2030,11 @@ class HexViewer(QMainWindow):
 
     def create_hex_view(self, file_path):
         try:
-            file_name = os.path.basename(file_path)
-            content = self.file_data.get(file_path, bytearray())
+            file_name = self.display_name(file_path)
+            content = self.file_data.get(file_path)
             
-            if not isinstance(content, bytearray):
-                raise ValueError(f"文件内容不是字节数组类型: {file_path}")
+            if not isinstance(content, ByteSource):
+                raise ValueError(f"文件内容不是有效的数据源: {file_path}")
             
             # 创建文件视图容器
             file_view = QFrame()
@@ -343,140 +2049,32 @@ class HexViewer(QMainWindow):
             file_label.setStyleSheet("font-weight: bold;")
             file_view_layout.addWidget(file_label)
             
-            # 创建滚动区域
-            scroll_area = QScrollArea()
-            scroll_area.setWidgetResizable(True)
-            self.scroll_areas[file_path] = scroll_area
+            # 创建只绘制可见行的十六进制窗格
+            pane = HexPane(
+                content,
+                lambda pos, fp=file_path: self.cell_color(fp, pos),
+                lambda start, end: self.differences.overlaps(start, end),
+            )
+            pane.setFont(QFont("Courier New", 10))
+            pane.editable = self.edit_mode
+            pane.set_runs(self.view_runs, self.expanded_runs)
+            pane.byte_clicked.connect(lambda pos, extend, fp=file_path: self.select_byte(fp, pos, extend))
+            pane.byte_edited.connect(lambda pos, value, fp=file_path: self.update_byte(pos, value, fp))
+            pane.run_toggled.connect(self.toggle_run)
+            self.hex_panes[file_path] = pane
             
-            # 获取滚动条并添加到列表
-            v_scroll_bar = scroll_area.verticalScrollBar()
-            h_scroll_bar = scroll_area.horizontalScrollBar()
-            self.scroll_bars.append(v_scroll_bar)
+            # 垂直滚动按行号同步，水平滚动按像素同步
+            pane.top_row_changed.connect(self.sync_v_scroll_bars)
+            h_scroll_bar = pane.horizontalScrollBar()
             self.h_scroll_bars.append(h_scroll_bar)
-            
-            # 连接滚动信号
-            v_scroll_bar.valueChanged.connect(self.sync_v_scroll_bars)
             h_scroll_bar.valueChanged.connect(self.sync_h_scroll_bars)
-
-            # 创建十六进制显示容器
-            hex_container = QWidget()
-            hex_layout = QVBoxLayout(hex_container)
-            hex_layout.setContentsMargins(5, 5, 5, 5)
-            hex_layout.setSpacing(0)
-            
-            # 固定宽度字体
-            font = QFont("Courier New", 10)
             
-            # 每行显示16字节
-            bytes_per_line = 16
-            total_lines = (len(content) + bytes_per_line - 1) // bytes_per_line
-            
-            # 创建地址列
-            for line in range(total_lines):
-                offset = line * bytes_per_line
-                line_end = min(offset + bytes_per_line, len(content))
-                
-                # 行布局
-                line_widget = QWidget()
-                line_layout = QHBoxLayout(line_widget)
-                line_layout.setContentsMargins(0, 0, 0, 0)
-                line_layout.setSpacing(10)
-                
-                # 地址显示
-                addr_label = QLabel(f"{offset:08X}")
-                addr_label.setFont(font)
-                addr_label.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
-                addr_label.setFixedWidth(80)
-                line_layout.addWidget(addr_label)
-                
-                # 十六进制显示区域
-                hex_display = QWidget()
-                hex_sub_layout = QHBoxLayout(hex_display)
-                hex_sub_layout.setContentsMargins(0, 0, 0, 0)
-                hex_sub_layout.setSpacing(5)
-                
-                for i in range(bytes_per_line):
-                    pos = offset + i
-                    if pos < len(content):
-                        byte = content[pos]
-                        
-                        if self.edit_mode:
-                            # 编辑模式下使用QLineEdit
-                            byte_edit = QLineEdit(f"{byte:02X}")
-                            byte_edit.setFont(font)
-                            byte_edit.setAlignment(Qt.AlignCenter)
-                            byte_edit.setFixedWidth(25)
-                            byte_edit.setMaxLength(2)
-                            byte_edit.textEdited.connect(lambda text, p=pos, fp=file_path: self.update_byte(text, p, fp))
-                            hex_sub_layout.addWidget(byte_edit)
-                            
-                            # 保存编辑控件引用
-                            if file_path not in self.byte_widgets:
-                                self.byte_widgets[file_path] = {}
-                            self.byte_widgets[file_path][pos] = byte_edit
-                        else:
-                            # 查看模式下使用QLabel
-                            byte_label = QLabel(f"{byte:02X}")
-                            byte_label.setFont(font)
-                            byte_label.setAlignment(Qt.AlignCenter)
-                            byte_label.setFixedWidth(20)
-                            
-                            # 标记差异的背景色
-                            byte_label.setAutoFillBackground(True)
-                            palette = byte_label.palette()
-                            palette.setColor(byte_label.backgroundRole(), Qt.white)
-                            byte_label.setPalette(palette)
-                            
-                            hex_sub_layout.addWidget(byte_label)
-                    else:
-                        # 填充空白
-                        empty_label = QLabel("  ")
-                        empty_label.setFont(font)
-                        hex_sub_layout.addWidget(empty_label)
-                
-                line_layout.addWidget(hex_display)
-                
-                # ASCII显示区域
-                ascii_display = QWidget()
-                ascii_layout = QHBoxLayout(ascii_display)
-                ascii_layout.setContentsMargins(0, 0, 0, 0)
-                ascii_layout.setSpacing(0)
-                
-                for i in range(bytes_per_line):
-                    pos = offset + i
-                    if pos < len(content):
-                        char = content[pos]
-                        if 32 <= char <= 126:
-                            char_label = QLabel(chr(char))
-                        else:
-                            char_label = QLabel(".")
-                        char_label.setFont(font)
-                        char_label.setAlignment(Qt.AlignCenter)
-                        char_label.setFixedWidth(12)
-                        
-                        # 标记差异的背景色
-                        char_label.setAutoFillBackground(True)
-                        palette = char_label.palette()
-                        palette.setColor(char_label.backgroundRole(), Qt.white)
-                        char_label.setPalette(palette)
-                        
-                        ascii_layout.addWidget(char_label)
-                    else:
-                        # 填充空白
-                        empty_label = QLabel(" ")
-                        empty_label.setFont(font)
-                        ascii_layout.addWidget(empty_label)
-                
-                line_layout.addWidget(ascii_display)
-                line_layout.addStretch()
-                
-                # 添加行部件
-                hex_layout.addWidget(line_widget)
+            # 与其他窗格对齐到同一行
+            if len(self.hex_panes) > 1:
+                other = next(iter(self.hex_panes.values()))
+                pane.set_top_row(other.top_row())
             
-            hex_layout.addStretch()
-            
-            scroll_area.setWidget(hex_container)
-            file_view_layout.addWidget(scroll_area)
+            file_view_layout.addWidget(pane)
             
             # 添加到主布局
             self.hex_layout.addWidget(file_view)
@@ -488,45 +2086,335 @@ class HexViewer(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "错误", f"创建十六进制视图失败: {str(e)}")
 
-    def update_byte(self, text, pos, file_path):
-        """更新字节数据"""
+    def toggle_run(self, offset):
+        """在所有窗格中同时展开或折叠单一字节区段"""
+        if offset in self.expanded_runs:
+            self.expanded_runs.remove(offset)
+        else:
+            self.expanded_runs.add(offset)
+        self.update_hex_layouts()
+    
+    def common_runs(self):
+        """所有已打开文件共有的单一字节区段，还有文件没有扫描完时返回空列表"""
+        if not all(source.runs_ready() for source in self.file_data.values()):
+            return []
+        runs = None
+        for source in self.file_data.values():
+            runs = source.runs() if runs is None else _intersect_runs(runs, source.runs())
+        return runs or []
+    
+    def scan_runs_step(self):
+        """推进后台的区段扫描，每次最多占用约30毫秒"""
+        deadline = time.monotonic() + 0.03
+        while self.run_scans and time.monotonic() < deadline:
+            file_path, scan = next(iter(self.run_scans.items()))
+            if self.file_data[file_path].runs_ready():
+                # 比对等操作已经同步扫描过
+                scan.close()
+                del self.run_scans[file_path]
+                continue
+            try:
+                scanned = next(scan)
+            except StopIteration:
+                del self.run_scans[file_path]
+                continue
+            except Exception as e:
+                del self.run_scans[file_path]
+                self.status_label.setText(f"扫描 {self.display_name(file_path)} 失败: {str(e)}")
+                continue
+            size = len(self.file_data[file_path])
+            self.scan_label.setText(
+                f"扫描区段 {self.display_name(file_path)} {scanned * 100 // max(size, 1)}%"
+            )
+        
+        if not self.run_scans:
+            self.run_scan_timer.stop()
+            self.scan_label.clear()
+            if self.update_view_runs():
+                self.update_hex_layouts()
+    
+    def update_view_runs(self):
+        """重新计算共有区段，变化时返回True（此时已有窗格需要重建）"""
+        runs = self.common_runs()
+        if runs == self.view_runs:
+            return False
+        self.view_runs = runs
+        return True
+    
+    def selection_range(self, selection=None):
+        """返回选区的 [起始, 结束) 偏移"""
+        _, anchor, current = selection or self.selection
+        return min(anchor, current), max(anchor, current) + 1
+    
+    def select_byte(self, file_path, pos, extend):
+        old_selection = self.selection
+        if extend and old_selection and old_selection[0] == file_path:
+            self.selection = (file_path, old_selection[1], pos)
+        else:
+            self.selection = (file_path, pos, pos)
+        
+        # 只重绘旧选区和新选区涉及的单元格
+        if old_selection:
+            self.repaint_cells(old_selection[0], *self.selection_range(old_selection))
+        start, end = self.selection_range()
+        self.repaint_cells(file_path, start, end)
+        for path, pane in self.hex_panes.items():
+            if pane.editable:
+                pane.set_cursor(pos if path == file_path else None)
+        self.status_label.setText(
+            f"已选择 {self.display_name(file_path)} 0x{start:08X}-0x{end - 1:08X}，共 {end - start} 字节"
+        )
+    
+    def cell_color(self, file_path, pos):
+        """单元格背景色：选区优先，其次是差异"""
+        if self.selection and self.selection[0] == file_path:
+            start, end = self.selection_range()
+            if start <= pos < end:
+                return QColor(MacaronColors.SKY_BLUE)
+        if pos in self.differences:
+            return QColor(255, 200, 200)
+        return QColor(Qt.white)
+    
+    def repaint_cells(self, file_path, start, end):
+        """重绘 [start, end) 范围内可见的单元格，数据和颜色都在绘制时读取"""
+        pane = self.hex_panes.get(file_path)
+        if pane is not None:
+            pane.update_range(start, end)
+    
+    def bulk_edit(self):
+        """对选区或所有文件执行填充、查找替换、XOR/加减运算，作为一个撤销步骤"""
+        operations = ["填充选区", "查找替换（当前文件）", "查找替换（所有文件）", "选区XOR", "选区加", "选区减"]
+        operation, ok = QInputDialog.getItem(self, "批量编辑", "操作:", operations, 0, False)
+        if not ok:
+            return
+        
+        changes = []
+        error = None
         try:
-            if len(text) == 2:
-                byte = int(text, 16)
-                self.file_data[file_path][pos] = byte
-                
-                # 更新ASCII显示
-                self.update_ascii_display(file_path, pos)
+            if operation.startswith("查找替换"):
+                if not self.file_data:
+                    return
+                if operation.endswith("（所有文件）"):
+                    file_paths = list(self.file_data)
+                elif self.selection:
+                    file_paths = [self.selection[0]]
+                else:
+                    row = max(self.file_list_widget.currentRow(), 0)
+                    file_paths = [self.file_list_widget.item(row, 2).text()]
+                find = self.ask_hex_bytes("查找替换", "查找的字节（十六进制）:")
+                if find is None:
+                    return
+                replace = self.ask_hex_bytes("查找替换", "替换为（十六进制，长度必须相同）:")
+                if replace is None:
+                    return
+                if len(replace) != len(find):
+                    raise ValueError("替换内容的长度必须与查找内容相同")
+                for file_path in file_paths:
+                    source = self.file_data[file_path]
+                    for pos in list(find_all(source, find)):
+                        # 先记录再写入，写入中途失败时也能撤销
+                        changes.append((file_path, pos, find))
+                        source.write(pos, replace)
+            else:
+                if not self.selection:
+                    QMessageBox.warning(self, "警告", "请先点击字节选择范围，按住Shift点击可扩展选区")
+                    return
+                file_path = self.selection[0]
+                start, end = self.selection_range()
+                if operation == "填充选区":
+                    pattern = self.ask_hex_bytes("填充选区", "填充的字节或模式（十六进制）:")
+                    if pattern is None:
+                        return
+                    make_chunk = lambda pos, old: repeat_pattern(pattern, (pos - start) % len(pattern), len(old))
+                else:
+                    op = {"选区XOR": "xor", "选区加": "add", "选区减": "sub"}[operation]
+                    operand = self.ask_hex_bytes(operation, "操作数（十六进制，XOR可以是多字节）:")
+                    if operand is None:
+                        return
+                    if op != "xor" and len(operand) != 1:
+                        raise ValueError("加减运算只支持单字节操作数")
+                    make_chunk = lambda pos, old: transform_bytes(old, op, operand, (pos - start) % len(operand))
+                self.edit_range(file_path, start, end, make_chunk, changes)
+        except Exception as e:
+            error = e
+        
+        # 中途失败时已经写入的部分同样作为一个撤销步骤保留
+        if changes:
+            self.push_undo(changes)
+            try:
+                self.refresh_after_edit(changes)
+            except Exception as e:
+                error = error or e
+        
+        count = self.undo_size(changes)
+        if error is not None:
+            if changes:
+                QMessageBox.warning(self, "错误", f"{operation}中途失败，已修改的 {count} 字节可以点击\"撤销\"恢复:\n{error}")
+            else:
+                QMessageBox.warning(self, "错误", str(error))
+        elif changes:
+            self.status_label.setText(f"{operation}完成，共修改 {count} 字节")
+        else:
+            self.status_label.setText(f"{operation}：没有需要修改的字节")
+    
+    def ask_hex_bytes(self, title, label):
+        text, ok = QInputDialog.getText(self, title, label)
+        if not ok:
+            return None
+        try:
+            data = bytes.fromhex(text)
         except ValueError:
-            pass
-    
-    def update_ascii_display(self, file_path, pos):
-        """更新ASCII显示"""
-        if file_path in self.hex_views:
-            file_view = self.hex_views[file_path]
-            scroll_area = file_view.findChild(QScrollArea)
-            if scroll_area:
-                hex_widget = scroll_area.widget()
-                if hex_widget:
-                    # 找到对应的行
-                    line = pos // 16
-                    line_widget = hex_widget.findChild(QWidget, f"line_{line}")
-                    if line_widget and line_widget.layout():
-                        # 获取ASCII显示区域
-                        ascii_item = line_widget.layout().itemAt(2)
-                        if ascii_item:
-                            ascii_widget = ascii_item.widget()
-                            if ascii_widget and ascii_widget.layout():
-                                char_pos = pos % 16
-                                item = ascii_widget.layout().itemAt(char_pos)
-                                if item:
-                                    char_label = item.widget()
-                                    if isinstance(char_label, QLabel):
-                                        byte = self.file_data[file_path][pos]
-                                        if 32 <= byte <= 126:
-                                            char_label.setText(chr(byte))
-                                        else:
-                                            char_label.setText(".")
+            raise ValueError(f"无效的十六进制内容: {text}")
+        if not data:
+            raise ValueError("内容不能为空")
+        return data
+    
+    def edit_range(self, file_path, start, end, make_chunk, changes):
+        """分块改写 [start, end)，make_chunk(偏移, 原数据) 返回新数据，原数据记入changes"""
+        source = self.file_data[file_path]
+        for pos in range(start, end, self.EDIT_CHUNK):
+            old = source.read(pos, min(self.EDIT_CHUNK, end - pos))
+            new = make_chunk(pos, old)
+            changes.append((file_path, pos, old))
+            source.write(pos, new)
+    
+    def push_undo(self, changes):
+        """压入一个撤销步骤，原数据计入页缓存的常驻内存
+
+        超过步数上限或常驻内存超过缓存预算时丢弃最早的步骤（至少保留最新一步）。
+        """
+        self.undo_stack.append(changes)
+        page_cache.pin(self.undo_size(changes))
+        while len(self.undo_stack) > 1 and (
+            len(self.undo_stack) > self.UNDO_LIMIT or page_cache.pinned > page_cache.budget
+        ):
+            page_cache.unpin(self.undo_size(self.undo_stack.pop(0)))
+        self.undo_button.setEnabled(True)
+    
+    @staticmethod
+    def undo_size(changes):
+        return sum(len(old) for _, _, old in changes)
+    
+    def clear_undo(self):
+        for changes in self.undo_stack:
+            page_cache.unpin(self.undo_size(changes))
+        self.undo_stack = []
+        self.undo_button.setEnabled(False)
+    
+    def undo_edit(self):
+        """撤销最近一次批量编辑"""
+        if not self.undo_stack:
+            return
+        changes = self.undo_stack.pop()
+        page_cache.unpin(self.undo_size(changes))
+        restored = 0
+        error = None
+        try:
+            for file_path, pos, old in reversed(changes):
+                self.file_data[file_path].write(pos, old)
+                restored += 1
+        except Exception as e:
+            error = e
+        
+        # 没能恢复的部分留在撤销栈中，可以再次撤销
+        remaining = changes[:len(changes) - restored]
+        if remaining:
+            self.push_undo(remaining)
+        self.undo_button.setEnabled(bool(self.undo_stack))
+        try:
+            self.refresh_after_edit(changes)
+        except Exception as e:
+            error = error or e
+        
+        if error is not None:
+            QMessageBox.warning(self, "错误", f"撤销批量编辑失败:\n{error}")
+        else:
+            self.status_label.setText("已撤销批量编辑")
+    
+    def refresh_after_edit(self, changes):
+        """只刷新被修改的范围：单元格文字、掩码、差异和高亮"""
+        affected = {}
+        for file_path, pos, data in changes:
+            affected.setdefault(file_path, []).append((pos, pos + len(data)))
+        all_ranges = ByteRanges()
+        for file_path, ranges in affected.items():
+            ranges = ByteRanges(ranges)
+            all_ranges = all_ranges.union(ranges)
+            self.invalidate_masks(file_path)
+        
+        # 修改打断了共有的单一字节区段时所有窗格一起重建，否则只更新修改的单元格
+        if self.update_view_runs():
+            self.update_hex_layouts()
+        
+        if self.compared and len(self.file_data) > 1:
+            partial = compute_differences(list(self.file_data.values()), all_ranges)
+            self.differences = self.apply_mask(self.differences.subtract(all_ranges).union(partial))
+        for start, end in all_ranges:
+            self.highlight_differences(self.differences, start, end)
+    
+    def choose_export_format(self, title):
+        if not self.selection:
+            QMessageBox.warning(self, "警告", "请先点击字节选择范围，按住Shift点击可扩展选区")
+            return None
+        labels = list(EXPORT_FORMATS.values())
+        label, ok = QInputDialog.getItem(self, title, "格式:", labels, 0, False)
+        if not ok:
+            return None
+        return list(EXPORT_FORMATS)[labels.index(label)]
+    
+    def copy_selection(self):
+        """按选定格式复制选区到剪贴板"""
+        fmt = self.choose_export_format("复制选区")
+        if not fmt:
+            return
+        file_path = self.selection[0]
+        start, end = self.selection_range()
+        if end - start > self.CLIPBOARD_LIMIT:
+            QMessageBox.warning(self, "警告", "选区太大，无法复制到剪贴板，请使用导出选区")
+            return
+        
+        chunks = iter_export_chunks(self.file_data[file_path], start, end, fmt)
+        if fmt == "raw":
+            mime = QMimeData()
+            mime.setData("application/octet-stream", QByteArray(b"".join(chunks)))
+            QApplication.clipboard().setMimeData(mime)
+        else:
+            QApplication.clipboard().setText("".join(chunks))
+        self.status_label.setText(f"已复制 {end - start} 字节（{EXPORT_FORMATS[fmt]}）")
+    
+    def export_selection(self):
+        """按选定格式分块导出选区到文件"""
+        fmt = self.choose_export_format("导出选区")
+        if not fmt:
+            return
+        save_path, _ = QFileDialog.getSaveFileName(self, "导出选区", self.last_dir, "所有文件 (*.*)")
+        if not save_path:
+            return
+        
+        file_path = self.selection[0]
+        start, end = self.selection_range()
+        try:
+            if fmt == "raw":
+                f = open(save_path, 'wb')
+            else:
+                f = open(save_path, 'w', encoding='utf-8', newline='\n')
+            with f:
+                for chunk in iter_export_chunks(self.file_data[file_path], start, end, fmt):
+                    f.write(chunk)
+            self.status_label.setText(f"已导出 {end - start} 字节到 {save_path}")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"导出失败: {str(e)}")
+    
+    def update_byte(self, pos, value, file_path):
+        """更新字节数据"""
+        try:
+            self.file_data[file_path][pos] = value
+            self.invalidate_masks(file_path)
+            if self.update_view_runs():
+                self.update_hex_layouts()
+            self.repaint_cells(file_path, pos, pos + 1)
+        except Exception as e:
+            QMessageBox.warning(self, "错误", f"修改字节失败: {str(e)}")
 
     def toggle_edit_mode(self):
         """切换编辑模式"""
@@ -538,23 +2426,25 @@ class HexViewer(QMainWindow):
         else:
             self.status_label.setText("编辑模式已禁用")
         
-        # 重新创建所有十六进制视图
-        for file_path in list(self.hex_views.keys()):
-            self.recreate_hex_view(file_path)
+        # 编辑模式下点击的字节作为输入位置
+        for file_path, pane in self.hex_panes.items():
+            pane.editable = self.edit_mode
+            selected = self.selection and self.selection[0] == file_path
+            pane.set_cursor(self.selection[2] if self.edit_mode and selected else None)
+    
+    def update_hex_layouts(self):
+        """共有区段或展开状态变化后，所有窗格重新划分行"""
+        # 各窗格按自己顶部的偏移换算新行号，期间不互相同步
+        self.scroll_sync_enabled = False
+        for pane in self.hex_panes.values():
+            pane.set_runs(self.view_runs, self.expanded_runs)
+        self.scroll_sync_enabled = True
     
-    def recreate_hex_view(self, file_path):
-        """重新创建十六进制视图"""
-        if file_path in self.hex_views:
-            # 移除旧视图
-            old_view = self.hex_views[file_path]
-            self.hex_layout.removeWidget(old_view)
-            old_view.setParent(None)
-            old_view.deleteLater()
-            
-            # 创建新视图
-            self.create_hex_view(file_path)
-
     def clear_all(self):
+        self.run_scans.clear()
+        self.run_scan_timer.stop()
+        self.scan_label.clear()
+        
         # 清除所有十六进制视图
         for i in reversed(range(self.hex_layout.count())): 
             widget = self.hex_layout.itemAt(i).widget()
@@ -563,12 +2453,19 @@ class HexViewer(QMainWindow):
                 widget.deleteLater()
         
         self.hex_views.clear()
-        self.scroll_areas.clear()
-        self.byte_widgets.clear()
+        self.hex_panes.clear()
+        self.expanded_runs.clear()
+        self.view_runs = []
+        self.selection = None
+        self.clear_undo()
+        self.compared = False
+        self.differences = ByteRanges()
+        self.mask_cache.clear()
         self.file_list_widget.setRowCount(0)
+        for content in self.file_data.values():
+            content.close()
         self.file_data.clear()
         self.compare_button.setEnabled(False)
-        self.scroll_bars = []
         self.h_scroll_bars = []
         self.edit_mode = False
         self.edit_button.setChecked(False)
@@ -580,137 +2477,136 @@ class HexViewer(QMainWindow):
             return
         
         try:
-            # 获取所有文件内容
-            files = list(self.file_data.items())
-            base_file_path, base_content = files[0]
-            other_files = files[1:]
-            
-            # 找到最大长度
-            max_len = len(base_content)
-            for file_path, content in other_files:
-                if len(content) > max_len:
-                    max_len = len(content)
-            
-            # 比较差异
-            differences = {}
-            for i in range(max_len):
-                if i >= len(base_content):
-                    # 基础文件比当前文件短
-                    byte_diff = True
-                else:
-                    base_byte = base_content[i]
-                    byte_diff = False
-                    
-                    for file_path, content in other_files:
-                        if i >= len(content) or content[i] != base_byte:
-                            byte_diff = True
-                            break
-                
-                if byte_diff:
-                    differences[i] = True
+            # 以第一个文件为基准，逐块比较所有文件
+            differences = compute_differences(list(self.file_data.values()))
+            self.differences = self.apply_mask(differences)
+            self.compared = True
+            
+            # 比对时已同步扫描出全部区段，不必等待后台扫描
+            if self.update_view_runs():
+                self.update_hex_layouts()
             
             # 在所有视图中高亮差异
-            for file_path, file_view in self.hex_views.items():
-                scroll_area = file_view.findChild(QScrollArea)
-                if not scroll_area:
-                    continue
-                    
-                hex_widget = scroll_area.widget()
-                if not hex_widget:
-                    continue
-                
-                # 遍历所有行
-                for line_widget in hex_widget.findChildren(QWidget):
-                    if not line_widget or not line_widget.layout():
-                        continue
-                    
-                    # 获取地址
-                    addr_item = line_widget.layout().itemAt(0)
-                    if not addr_item:
-                        continue
-                        
-                    addr_label = addr_item.widget()
-                    if not isinstance(addr_label, QLabel):
-                        continue
-                    
-                    try:
-                        offset = int(addr_label.text(), 16)
-                    except:
-                        continue
-                    
-                    # 检查这一行是否有差异
-                    has_diff = False
-                    for i in range(16):
-                        pos = offset + i
-                        if pos in differences:
-                            has_diff = True
-                            break
-                    
-                    if has_diff:
-                        # 高亮整行
-                        line_widget.setAutoFillBackground(True)
-                        palette = line_widget.palette()
-                        palette.setColor(line_widget.backgroundRole(), QColor(255, 255, 200))
-                        line_widget.setPalette(palette)
-                        
-                        # 高亮具体差异字节
-                        hex_sub_item = line_widget.layout().itemAt(1)
-                        if hex_sub_item:
-                            hex_sub_widget = hex_sub_item.widget()
-                            if hex_sub_widget and hex_sub_widget.layout():
-                                for i in range(hex_sub_widget.layout().count()):
-                                    item = hex_sub_widget.layout().itemAt(i)
-                                    if item:
-                                        widget = item.widget()
-                                        if isinstance(widget, (QLabel, QLineEdit)):
-                                            pos = offset + i
-                                            if pos in differences:
-                                                palette = widget.palette()
-                                                palette.setColor(widget.backgroundRole(), QColor(255, 200, 200))
-                                                widget.setPalette(palette)
-                        
-                        # 高亮ASCII部分
-                        ascii_item = line_widget.layout().itemAt(2)
-                        if ascii_item:
-                            ascii_widget = ascii_item.widget()
-                            if ascii_widget and ascii_widget.layout():
-                                for i in range(ascii_widget.layout().count()):
-                                    item = ascii_widget.layout().itemAt(i)
-                                    if item:
-                                        char_label = item.widget()
-                                        if isinstance(char_label, QLabel):
-                                            pos = offset + i
-                                            if pos in differences:
-                                                palette = char_label.palette()
-                                                palette.setColor(char_label.backgroundRole(), QColor(255, 200, 200))
-                                                char_label.setPalette(palette)
-            
-            self.status_label.setText(f"比对完成，共发现 {len(differences)} 处差异")
+            self.highlight_differences(self.differences)
+            
+            self.status_label.setText(
+                f"比对完成，共发现 {len(self.differences)} 处差异{self.mask_summary(differences)}"
+            )
         
         except Exception as e:
             QMessageBox.critical(self, "错误", f"比对过程中发生错误: {str(e)}")
 
 
+    def load_mask_profiles(self, select=None):
+        """从数据库加载掩码配置到下拉框"""
+        current = select or self.get_db_setting("active_mask_profile", "")
+        self.mask_profiles = {}
+        for name, rules in self.db_cursor.execute("SELECT name, rules FROM mask_profiles ORDER BY name"):
+            self.mask_profiles[name] = MaskProfile(name, json.loads(rules))
+        
+        self.mask_combo.blockSignals(True)
+        self.mask_combo.clear()
+        self.mask_combo.addItem("不使用掩码", "")
+        for name in self.mask_profiles:
+            self.mask_combo.addItem(name, name)
+        index = self.mask_combo.findData(current)
+        self.mask_combo.setCurrentIndex(max(index, 0))
+        self.mask_combo.blockSignals(False)
+    
+    def mask_profile_changed(self):
+        self.set_db_setting("active_mask_profile", self.mask_combo.currentData() or "")
+    
+    def edit_mask_profile(self):
+        """新建或编辑掩码配置"""
+        new_label = "<新建掩码>"
+        names = list(self.mask_profiles) + [new_label]
+        current = self.mask_combo.currentData()
+        name, ok = QInputDialog.getItem(
+            self, "编辑掩码", "选择掩码配置:", names, names.index(current) if current else len(names) - 1, False
+        )
+        if not ok:
+            return
+        if name == new_label:
+            name, ok = QInputDialog.getText(self, "新建掩码", "掩码名称:")
+            name = name.strip()
+            if not ok or not name:
+                return
+        
+        profile = self.mask_profiles.get(name, MaskProfile(name, []))
+        text, ok = QInputDialog.getMultiLineText(
+            self, f"编辑掩码 - {name}",
+            "每行一条规则（结束偏移不包含，留空则删除该掩码）:\n"
+            "range 起始 结束\n"
+            "pattern 特征十六进制 相对偏移 长度",
+            profile.to_text()
+        )
+        if not ok:
+            return
+        
+        try:
+            if text.strip():
+                profile = MaskProfile.parse(name, text)
+                self.db_cursor.execute(
+                    "INSERT OR REPLACE INTO mask_profiles (name, rules) VALUES (?, ?)",
+                    (name, json.dumps(profile.rules))
+                )
+            else:
+                self.db_cursor.execute("DELETE FROM mask_profiles WHERE name = ?", (name,))
+                name = ""
+            self.db_conn.commit()
+        except ValueError as e:
+            QMessageBox.warning(self, "错误", f"掩码格式错误:\n{str(e)}")
+            return
+        
+        self.mask_cache = {key: mask for key, mask in self.mask_cache.items() if key[0] != profile.name}
+        self.load_mask_profiles(select=name)
+        self.mask_profile_changed()
+    
+    def invalidate_masks(self, file_path):
+        """文件内容变化后丢弃其编译过的掩码"""
+        self.mask_cache = {key: mask for key, mask in self.mask_cache.items() if key[1] != file_path}
+    
+    def compiled_mask(self):
+        """返回当前掩码在所有文件上的忽略区间，每个文件只编译一次"""
+        profile = self.mask_profiles.get(self.mask_combo.currentData())
+        if profile is None:
+            return None
+        mask = ByteRanges()
+        for file_path, content in self.file_data.items():
+            key = (profile.name, file_path)
+            if key not in self.mask_cache:
+                self.mask_cache[key] = profile.compile(content)
+            mask = mask.union(self.mask_cache[key])
+        return mask
+    
+    def apply_mask(self, differences):
+        mask = self.compiled_mask()
+        return differences if mask is None else differences.subtract(mask)
+    
+    def mask_summary(self, differences):
+        ignored = len(differences) - len(self.differences)
+        return f"（掩码已忽略 {ignored} 处）" if self.mask_combo.currentData() else ""
+    
     def closeEvent(self, event):
         self.save_settings()
         self.db_conn.close()
         event.accept()
 
-    def sync_v_scroll_bars(self, value):
-        """同步垂直滚动条位置和内容视图"""
+    def sync_v_scroll_bars(self, row):
+        """按行号同步所有窗格的垂直位置（各窗格折叠的区段相同，同一行号对应同一偏移）"""
         if not self.scroll_sync_enabled:
             return
             
-        # 获取发送信号的滚动条
+        # 获取发送信号的窗格
         sender = self.sender()
         
         # 阻塞所有滚动条信号以避免递归
         self.scroll_sync_enabled = False
         
-        # 同步所有垂直滚动条位置
-        for scroll_bar in self.scroll_bars:
-            if scroll_bar != sender:
-                scroll_bar.setValue(value)
+        # 同步所有窗格的顶部行
+        for pane in self.hex_panes.values():
+            if pane is not sender:
+                pane.set_top_row(row)
         
         # 解除信号阻塞
         self.scroll_sync_enabled = True
@@ -741,112 +2637,36 @@ class HexViewer(QMainWindow):
             return
         
         try:
-            # 获取所有文件内容
-            files = list(self.file_data.items())
-            
-            # 找到最大长度
-            max_len = max(len(content) for _, content in files)
-            
-            # 比较差异 - 找出所有文件中不相同的字节位置
-            differences = {}
-            for i in range(max_len):
-                # 收集所有文件在该位置的字节值
-                byte_values = set()
-                for file_path, content in files:
-                    if i < len(content):
-                        byte_values.add(content[i])
-                    else:
-                        byte_values.add(None)  # 表示文件比最短的文件长
-                
-                # 如果有超过1个不同的值，则标记为差异
-                if len(byte_values) > 1:
-                    differences[i] = True
+            # 某个位置上所有文件的字节值不完全相同，等价于存在与第一个文件不同的文件
+            differences = compute_differences(list(self.file_data.values()))
+            self.differences = self.apply_mask(differences)
+            self.compared = True
+            
+            # 比对时已同步扫描出全部区段，不必等待后台扫描
+            if self.update_view_runs():
+                self.update_hex_layouts()
             
             # 高亮差异
-            self.highlight_differences(differences)
+            self.highlight_differences(self.differences)
             
-            self.status_label.setText(f"多基准比对完成，共发现 {len(differences)} 处差异")
+            self.status_label.setText(
+                f"多基准比对完成，共发现 {len(self.differences)} 处差异{self.mask_summary(differences)}"
+            )
             
         except Exception as e:
             QMessageBox.critical(self, "错误", f"多基准比对过程中发生错误: {str(e)}")
 
-    def highlight_differences(self, differences):
-        """高亮显示差异位置（重构后的通用方法）"""
-        for file_path, file_view in self.hex_views.items():
-            scroll_area = file_view.findChild(QScrollArea)
-            if not scroll_area:
-                continue
-                
-            hex_widget = scroll_area.widget()
-            if not hex_widget:
-                continue
-            
-            # 遍历所有行
-            for line_widget in hex_widget.findChildren(QWidget):
-                if not line_widget or not line_widget.layout():
-                    continue
-                
-                # 获取地址
-                addr_item = line_widget.layout().itemAt(0)
-                if not addr_item:
-                    continue
-                    
-                addr_label = addr_item.widget()
-                if not isinstance(addr_label, QLabel):
-                    continue
-                
-                try:
-                    offset = int(addr_label.text(), 16)
-                except:
-                    continue
-                
-                # 检查这一行是否有差异
-                has_diff = False
-                for i in range(16):
-                    pos = offset + i
-                    if pos in differences:
-                        has_diff = True
-                        break
-                
-                if has_diff:
-                    # 高亮整行
-                    line_widget.setAutoFillBackground(True)
-                    palette = line_widget.palette()
-                    palette.setColor(line_widget.backgroundRole(), QColor(255, 255, 200))
-                    line_widget.setPalette(palette)
-                    
-                    # 高亮具体差异字节
-                    hex_sub_item = line_widget.layout().itemAt(1)
-                    if hex_sub_item:
-                        hex_sub_widget = hex_sub_item.widget()
-                        if hex_sub_widget and hex_sub_widget.layout():
-                            for i in range(hex_sub_widget.layout().count()):
-                                item = hex_sub_widget.layout().itemAt(i)
-                                if item:
-                                    widget = item.widget()
-                                    if isinstance(widget, (QLabel, QLineEdit)):
-                                        pos = offset + i
-                                        if pos in differences:
-                                            palette = widget.palette()
-                                            palette.setColor(widget.backgroundRole(), QColor(255, 200, 200))
-                                            widget.setPalette(palette)
-                    
-                    # 高亮ASCII部分
-                    ascii_item = line_widget.layout().itemAt(2)
-                    if ascii_item:
-                        ascii_widget = ascii_item.widget()
-                        if ascii_widget and ascii_widget.layout():
-                            for i in range(ascii_widget.layout().count()):
-                                item = ascii_widget.layout().itemAt(i)
-                                if item:
-                                    char_label = item.widget()
-                                    if isinstance(char_label, QLabel):
-                                        pos = offset + i
-                                        if pos in differences:
-                                            palette = char_label.palette()
-                                            palette.setColor(char_label.backgroundRole(), QColor(255, 200, 200))
-                                            char_label.setPalette(palette)
+    def highlight_differences(self, differences, start=0, end=None):
+        """高亮显示差异位置（重构后的通用方法），可以只重绘 [start, end) 范围
 
+        窗格绘制时按 self.differences 决定单元格和整行的颜色，这里只需要重绘可见部分。
+        """
+        self.differences = differences
+        for pane in self.hex_panes.values():
+            if end is None:
+                pane.viewport().update()
+            else:
+                pane.update_range(start, end)
 
 
 if __name__ == "__main__":